@@ -0,0 +1,112 @@
+from typing import Callable, List
+from datetime import datetime
+from src.core import LogosCluster
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+'''
+Micro-benchmark for per-call LogosCluster lookup latency.
+
+Compares the old connect-per-call lookups against the pooled connections of LogosCluster,
+and read/write connections against the read_only (immutable, memory-mapped) serving mode.
+Run from the repo root:
+python3 -m benchmark.evals.measure_cluster_latency
+'''
+
+NUM_NODES = 4
+ROWS_PER_NODE = 20000
+NUM_CALLS = 5000
+IDS_PER_CALL = 5  # roughly one smart_query top_k split across topics
+BULK_IDS = 10000
+COLD_CALLS = 200
+
+
+def connect_per_call_query_by_ids(data_dir: str, table_name: str, row_ids: List[int], node: str) -> list:
+    '''
+    Baseline: how query_by_ids looked up rows before connection pooling
+    '''
+    with sqlite3.connect(f'{data_dir}/{node}.db') as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f'SELECT * FROM {table_name} WHERE ID IN ({",".join([str(_id) for _id in row_ids])})')
+        return cursor.fetchall()
+
+
+def drop_page_cache(path: str) -> None:
+    # evict a node file from the OS page cache so the next read hits the disk
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def time_calls(func: Callable, calls: list) -> List[float]:
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name: str, latencies: List[float]) -> None:
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1e6
+    p95 = latencies[int(len(latencies) * 0.95)] * 1e6
+    mean = statistics.mean(latencies) * 1e6
+    print(f'{name:<24} mean: {mean:8.1f} us | p50: {p50:8.1f} us | p95: {p95:8.1f} us')
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as data_dir:
+        with LogosCluster(data_dir=data_dir) as cluster:
+            cluster.nodes = [f'node-{i}' for i in range(NUM_NODES)]
+            cluster.build_cluster()
+
+            print(f'Populating {NUM_NODES} nodes with {ROWS_PER_NODE} rows each...')
+            now = datetime.now().isoformat()
+            for node in cluster.nodes:
+                cluster.insert_batch(
+                    [(f'{node} paragraph {i} ' * 20, now) for i in range(ROWS_PER_NODE)], node)
+
+            random.seed(0)
+            calls = [(random.sample(range(1, ROWS_PER_NODE + 1), IDS_PER_CALL), random.choice(cluster.nodes))
+                     for _ in range(NUM_CALLS)]
+
+            print(f'Timing {NUM_CALLS} query_by_ids calls of {IDS_PER_CALL} IDs each...')
+            before = time_calls(lambda ids, node: connect_per_call_query_by_ids(
+                data_dir, cluster.table_name, ids, node), calls)
+            after = time_calls(cluster.query_by_ids, calls)
+
+            report('connect per call', before)
+            report('pooled connections', after)
+            print(
+                f'Speedup (mean): {statistics.mean(before) / statistics.mean(after):.2f}x')
+
+            print(f'Timing {NUM_CALLS} single-row query calls...')
+            single_calls = [(ids[0], node) for ids, node in calls]
+            report('pooled query', time_calls(cluster.query, single_calls))
+
+            print(f'Timing bulk re-hydration of {BULK_IDS} IDs...')
+            bulk_calls = [(random.sample(range(1, ROWS_PER_NODE + 1), BULK_IDS), node) for node in cluster.nodes]
+            report('query_by_ids (bulk)', time_calls(cluster.query_by_ids, bulk_calls))
+
+        print(f'Timing cold (first {COLD_CALLS} calls after dropping the page cache) and warm query_by_ids...')
+        for name, read_only in [('read/write', False), ('read_only', True)]:
+            with LogosCluster(data_dir=data_dir, read_only=read_only) as serving:
+                serving.nodes = cluster.nodes
+                for node in serving.nodes:
+                    drop_page_cache(os.path.join(data_dir, f'{node}.db'))
+                report(f'{name} cold', time_calls(serving.query_by_ids, calls[:COLD_CALLS]))
+                if read_only:
+                    serving.warm_up()
+                report(f'{name} warm', time_calls(serving.query_by_ids, calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+from typing import List
+from datetime import datetime
+from src.core import LogosCluster
+import os
+import random
+import statistics
+import tempfile
+import time
+
+'''
+Benchmark for compressed Content storage in LogosCluster nodes.
+
+Loads the same rows into a plain and a compressed node and reports bytes on disk,
+query_by_ids latency (decompression cost) and cold full-node read time.
+Uses the first ROWS rows of INPUT_FILE when it exists, a synthetic corpus otherwise.
+Run from the repo root:
+python3 -m benchmark.evals.measure_compression
+'''
+
+INPUT_FILE = 'inputs/inputs.csv'
+ROWS = 50000
+NUM_CALLS = 2000
+IDS_PER_CALL = 5
+
+
+def load_paragraphs() -> List[str]:
+    if os.path.exists(INPUT_FILE):
+        import pandas as pd
+        df = pd.read_csv(INPUT_FILE, nrows=ROWS, usecols=[0], header=None, names=['content'])
+        return df['content'].astype(str).tolist()
+
+    # synthetic Zipf-like vocabulary, close enough to encyclopedic text for relative numbers
+    random.seed(0)
+    vocab = [f'word{i}' for i in range(5000)] + ['the', 'of', 'and', 'in', 'is', 'a', 'to', 'was', 'for', 'as']
+    weights = [1 / (i + 1) for i in range(len(vocab))]
+    random.shuffle(weights)
+    return [' '.join(random.choices(vocab, weights, k=random.randint(60, 200))) + '.' for _ in range(ROWS)]
+
+
+def drop_page_cache(path: str) -> None:
+    # evict the node file from the OS page cache so the next read hits the disk
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def time_lookups(cluster: LogosCluster, node: str, calls: List[List[int]]) -> float:
+    start = time.perf_counter()
+    for ids in calls:
+        cluster.query_by_ids(ids, node)
+    return (time.perf_counter() - start) / len(calls)
+
+
+def time_cold_scan(cluster: LogosCluster, node: str) -> float:
+    cluster.close()
+    drop_page_cache(os.path.join(cluster.data_dir, f'{node}.db'))
+    start = time.perf_counter()
+    for _ in cluster.query_chunk(node, 1000):
+        pass
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    paragraphs = load_paragraphs()
+    now = datetime.now().isoformat()
+    print(f'Loaded {len(paragraphs)} paragraphs ({sum(len(p) for p in paragraphs):,} chars)')
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        results = {}
+        for name, compress in [('plain', False), ('compressed', True)]:
+            cluster = LogosCluster(data_dir=data_dir, compress=compress)
+            cluster.nodes = [name]
+            cluster.build_cluster()
+            for i in range(0, len(paragraphs), 10000):
+                cluster.insert_batch([(p, now) for p in paragraphs[i:i + 10000]], name)
+            cluster.close()
+
+            random.seed(1)
+            calls = [random.sample(range(1, len(paragraphs) + 1), IDS_PER_CALL) for _ in range(NUM_CALLS)]
+            lookup = time_lookups(cluster, name, calls)
+            cold = statistics.median(time_cold_scan(cluster, name) for _ in range(3))
+            size = os.path.getsize(os.path.join(data_dir, f'{name}.db'))
+            codec = cluster._codec(name)
+            results[name] = (size, lookup, cold)
+            cluster.close()
+
+            print(f'{name:<11} codec: {codec.kind if codec else "none":<5} | on disk: {size / 2**20:8.2f} MiB | '
+                  f'query_by_ids({IDS_PER_CALL}): {lookup * 1e6:7.1f} us | cold scan: {cold:.3f} s')
+
+        plain, compressed = results['plain'], results['compressed']
+        print(f'Disk ratio: {plain[0] / compressed[0]:.2f}x smaller')
+        print(f'Decompression cost per query_by_ids: {(compressed[1] - plain[1]) * 1e6:+.1f} us')
+        print(f'Cold read speedup: {plain[2] / compressed[2]:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+from typing import List, Tuple
+from types import SimpleNamespace
+from src.core.sumdb_backends import LocalBackend
+from src.core.ivfpq import IVFPQBackend
+import numpy as np
+import statistics
+import tempfile
+import time
+
+'''
+Benchmark of the IVF-PQ SumDB backend against exact search on a synthetic corpus.
+
+Vectors are noisy samples around random cluster centres (summaries of one topic land close together),
+queries are fresh samples of the same distribution. Reports recall@k against exact search, per-query
+latency and resident index memory for a range of nprobe and re-rank shortlist sizes.
+Run from the repo root:
+python3 -m benchmark.evals.measure_sumdb_ann
+'''
+
+NUM_VECTORS = 200000
+DIM = 256
+NUM_CLUSTERS = 1000
+NOISE = 0.6  # spread of a cluster relative to the distance between centres
+NUM_QUERIES = 200
+TOP_K = 10
+INSERT_BATCH = 10000
+
+NLIST = 512
+PQ_M = 32
+NPROBES = (1, 4, 16, 64)
+RERANK_FACTORS = (8, 32)  # shortlist size over top_k, PQ error is corrected within the shortlist only
+
+
+def synthetic(rng: np.random.Generator, centres: np.ndarray, n: int) -> np.ndarray:
+    points = centres[rng.integers(len(centres), size=n)] + NOISE * rng.standard_normal((n, DIM)) / np.sqrt(DIM)
+    return (points / np.linalg.norm(points, axis=1, keepdims=True)).astype(np.float32)
+
+
+def time_queries(backend: LocalBackend, queries: np.ndarray) -> Tuple[List[np.ndarray], List[float]]:
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        positions, _ = backend.search_vectors(query, TOP_K)
+        latencies.append(time.perf_counter() - start)
+        results.append(positions[0])
+    return results, latencies
+
+
+def report(name: str, latencies: List[float], recall: float, memory: int) -> None:
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1e3
+    p95 = latencies[int(len(latencies) * 0.95)] * 1e3
+    print(f'{name:<24} recall@{TOP_K}: {recall:6.3f} | mean: {statistics.mean(latencies) * 1e3:7.2f} ms | '
+          f'p50: {p50:7.2f} ms | p95: {p95:7.2f} ms | memory: {memory / 2 ** 20:8.1f} MiB')
+
+
+def main() -> None:
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((NUM_CLUSTERS, DIM)) / np.sqrt(DIM)
+    vectors = synthetic(rng, centres, NUM_VECTORS)
+    queries = synthetic(rng, centres, NUM_QUERIES)
+    documents = [{'_id': str(i), 'row_id': i, 'summary': '', 'topic': 'synthetic'} for i in range(NUM_VECTORS)]
+
+    with tempfile.TemporaryDirectory() as exact_dir, tempfile.TemporaryDirectory() as ann_dir:
+        # vectors are inserted and searched directly, the backends only need their dimension, no embedder or embedding cache
+        vectors_only = SimpleNamespace(dim=DIM)
+        exact = LocalBackend(exact_dir, vectors_only, cache_bytes=0)
+        ann = IVFPQBackend(ann_dir, vectors_only, nlist=NLIST, m=PQ_M, auto_train=False, cache_bytes=0)
+
+        print(f'Inserting {NUM_VECTORS} vectors of dimension {DIM}...')
+        for i in range(0, NUM_VECTORS, INSERT_BATCH):
+            exact.add_vectors(documents[i:i + INSERT_BATCH], vectors[i:i + INSERT_BATCH])
+            ann.add_vectors(documents[i:i + INSERT_BATCH], vectors[i:i + INSERT_BATCH])
+
+        start = time.perf_counter()
+        ann.train()
+        print(f'Trained IVF-PQ (nlist={NLIST}, m={PQ_M}) in {time.perf_counter() - start:.1f} seconds')
+
+        print(f'Timing {NUM_QUERIES} queries, top {TOP_K}...')
+        truth, latencies = time_queries(exact, queries)
+        report('exact', latencies, 1.0, NUM_VECTORS * DIM * 4)
+
+        for rerank_factor in RERANK_FACTORS:
+            for nprobe in NPROBES:
+                ann.nprobe = nprobe
+                ann.rerank_factor = rerank_factor
+                found, latencies = time_queries(ann, queries)
+                recall = statistics.mean(len(np.intersect1d(a, b)) / len(b) for a, b in zip(found, truth))
+                report(f'ivfpq nprobe={nprobe} x{rerank_factor}', latencies, recall, ann.memory_bytes())
+
+        exact.close()
+        ann.close()
+
+
+if __name__ == '__main__':
+    main()
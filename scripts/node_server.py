@@ -0,0 +1,31 @@
+from src.core.node_server import NodeServer
+import os
+
+'''
+This file serves the local nodes of a LogosCluster to other machines, see src/core/node_server.py.
+
+Clients list the nodes it serves in their placement file (one 'node host:port' pair per line)
+and call LogosCluster.set_placement_file. Clients and server must share LOGOS_AUTHKEY,
+which is required to listen on anything but localhost.
+python3 -m scripts.node_server
+'''
+
+
+def main():
+    in_dir = 'inputs'
+    metadata_file = 'metadata.txt'  # ! Nodes served by this machine, one per line
+    logos_dir = 'auxi_cluster'  # ! Default cluster data directory
+    address = 'localhost:7001'  # ! Listen address, e.g. '0.0.0.0:7001' with LOGOS_AUTHKEY set
+
+    with open(os.path.join(in_dir, metadata_file), 'r') as f:
+        nodes = f.read().splitlines()
+
+    server = NodeServer(logos_dir, nodes, address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
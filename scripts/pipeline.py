@@ -59,7 +59,7 @@ def main():
     # Populate the cluster with data
     # step_start = time.perf_counter()
     # print('Populating the cluster with data...')
-    # cluster.auto_insert()
+    # cluster.auto_insert(bulk_load=True)  # WAL + relaxed sync for the initial load
     # print(f'Populate cluster: {time.perf_counter() - step_start:.2f} seconds')
 
     # Step 2: Launch SumDB
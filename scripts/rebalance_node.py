@@ -0,0 +1,31 @@
+from src.core import LogosCluster
+import os
+
+'''
+This file splits a hot LogosCluster node into several shard files.
+
+Run it while nothing is writing to the cluster:
+python3 -m scripts.rebalance_node
+'''
+
+
+def main():
+    in_dir = 'inputs'
+    metadata_file = 'metadata.txt'
+    logos_dir = 'auxi_cluster'  # ! Default cluster data directory
+
+    node = 'Physics'  # ! The oversized node to split, see test/analyze_input.py for row counts per topic
+    num_shards = 4
+
+    cluster = LogosCluster(data_dir=logos_dir)
+    cluster.set_metadata(os.path.join(in_dir, metadata_file))
+
+    print(f'Rebalancing node {node} into {num_shards} shards...')
+    if not cluster.rebalance(node, num_shards):
+        print('Rebalance failed, node left unchanged')
+
+    cluster.close()
+
+
+if __name__ == '__main__':
+    main()
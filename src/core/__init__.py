@@ -1,2 +1,3 @@
 from .cluster import LogosCluster
+from .async_cluster import AsyncLogosCluster
 from .sumdb import SumDB
\ No newline at end of file
@@ -0,0 +1,115 @@
+from typing import Iterator, List, Tuple
+from datetime import datetime
+from urllib.parse import quote
+import os
+import shutil
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+'''
+This file contains the columnar (Apache Arrow / Parquet) views of LogosCluster nodes.
+
+Rows become RecordBatches with an int64 ID column and string Content/UpdatedAt columns.
+A cluster export is a Hive-partitioned Parquet dataset, one directory per node:
+
+    out_dir/topic=<node>/part-00000.parquet
+
+which pyarrow.dataset, pandas, polars, DuckDB or Spark can scan without touching SQLite, e.g.
+pyarrow.dataset.dataset(out_dir, partitioning='hive').
+'''
+
+PARTITION_KEY = 'topic'
+ROWS_PER_FILE = 1000000  # a node is split over several files past this many rows
+PARQUET_COMPRESSION = 'zstd'
+
+
+def require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError('LogosCluster: Arrow/Parquet support needs pyarrow, pip install pyarrow')
+
+
+def batch_schema() -> 'pa.Schema':
+    require_pyarrow()
+    return pa.schema([
+        pa.field('ID', pa.int64(), nullable=False),
+        pa.field('Content', pa.string()),
+        pa.field('UpdatedAt', pa.string()),
+    ])
+
+
+def rows_to_batch(rows: List[Tuple[int, str, datetime]]) -> 'pa.RecordBatch':
+    '''
+    Turn query rows (ID, Content, UpdatedAt) into one RecordBatch, column by column
+    '''
+    schema = batch_schema()
+    if not rows:
+        return pa.RecordBatch.from_pylist([], schema=schema)
+
+    ids, contents, updated = zip(*rows)
+    return pa.RecordBatch.from_arrays([
+        pa.array(ids, type=pa.int64()),
+        # Content is TEXT, but rows loaded from pandas may hold numbers (e.g. NaN for empty cells)
+        pa.array([content if isinstance(content, str) or content is None else str(content) for content in contents], type=pa.string()),
+        pa.array([None if value is None else str(value) for value in updated], type=pa.string()),
+    ], schema=schema)
+
+
+def partition_dir(out_dir: str, node: str) -> str:
+    # node names are URI-encoded the way Hive partitioning readers expect
+    return os.path.join(out_dir, f'{PARTITION_KEY}={quote(node, safe="")}')
+
+
+def write_node(batches: Iterator['pa.RecordBatch'], out_dir: str, node: str, rows_per_file: int = ROWS_PER_FILE) -> int:
+    '''
+    Write one node's batches to its partition directory, replacing an earlier export, return the number of rows written
+
+    Every batch becomes a row group, a new file is started once the current one holds rows_per_file rows.
+    Files are written to a hidden directory next to the partition and swapped in once complete, so an error
+    leaves the previous export in place.
+    '''
+    require_pyarrow()
+    target = partition_dir(out_dir, node)
+    # dot-prefixed names are skipped by dataset readers scanning out_dir
+    staging = os.path.join(out_dir, f'.{os.path.basename(target)}.tmp-{os.getpid()}')
+    retired = os.path.join(out_dir, f'.{os.path.basename(target)}.old-{os.getpid()}')
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    schema = batch_schema()
+    writer = None
+    parts = 0
+    file_rows = 0
+    total = 0
+    try:
+        try:
+            for batch in batches:
+                if writer is None or file_rows >= rows_per_file:
+                    if writer is not None:
+                        writer.close()
+                    writer = pq.ParquetWriter(os.path.join(staging, f'part-{parts:05d}.parquet'), schema,
+                                              compression=PARQUET_COMPRESSION)
+                    parts += 1
+                    file_rows = 0
+                writer.write_batch(batch)
+                file_rows += batch.num_rows
+                total += batch.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+
+        # the partition is missing only between the two renames, never half written
+        if os.path.exists(target):
+            shutil.rmtree(retired, ignore_errors=True)
+            os.rename(target, retired)
+        os.rename(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    shutil.rmtree(retired, ignore_errors=True)
+    return total
@@ -0,0 +1,160 @@
+from typing import AsyncIterator, Callable, Dict, List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import asyncio
+import threading
+from .cluster import LogosCluster, MAX_ROW_ID
+
+'''
+This file contains the AsyncLogosCluster class, an asyncio front end of LogosCluster for the serving path.
+
+sqlite3 calls block, so every call runs on a small thread pool dedicated to its node. A slow or busy node
+only queues its own requests, and the event loop is never stalled by a query.
+'''
+
+# threads per node, i.e. SQLite reads of one node running at the same time
+DEFAULT_NODE_THREADS = 4
+
+# calls per node admitted at once (running or queued on its threads), further callers wait on the event loop
+DEFAULT_NODE_CONCURRENCY = 32
+
+
+class AsyncLogosCluster:
+    '''
+    Awaitable LogosCluster reads (and batched writes) on bounded per-node executors
+
+    Example usage:
+    async with AsyncLogosCluster(LogosCluster('auxi_logos')) as cluster:
+        rows = await cluster.query_by_ids([1, 2, 3], 'Physics')
+        async for chunk in cluster.query_chunk('Physics'):
+            ...
+    '''
+
+    def __init__(self, cluster: LogosCluster, node_threads: int = DEFAULT_NODE_THREADS, node_concurrency: int = DEFAULT_NODE_CONCURRENCY) -> None:
+        self.cluster = cluster
+        self.node_threads = node_threads
+        self.node_concurrency = node_concurrency
+
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._limits: Dict[str, asyncio.Semaphore] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def nodes(self) -> List[str]:
+        return self.cluster.nodes
+
+    async def __aenter__(self) -> 'AsyncLogosCluster':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        '''
+        Shut down the node executors without blocking the event loop, then close the wrapped cluster
+        '''
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors = {}
+            self._limits = {}
+        for executor in executors:
+            await asyncio.to_thread(executor.shutdown, wait=True)
+        self.cluster.close()
+
+    def _executor(self, node: str) -> ThreadPoolExecutor:
+        with self._lock:
+            executor = self._executors.get(node)
+            if executor is None:
+                executor = self._executors[node] = ThreadPoolExecutor(
+                    max_workers=self.node_threads, thread_name_prefix=f'logos-{node}')
+            return executor
+
+    def _limit(self, node: str) -> asyncio.Semaphore:
+        limit = self._limits.get(node)
+        if limit is None:
+            limit = self._limits[node] = asyncio.Semaphore(self.node_concurrency)
+        return limit
+
+    async def _run(self, node: str, func: Callable, *args):
+        async with self._limit(node):
+            return await asyncio.get_running_loop().run_in_executor(self._executor(node), func, *args)
+
+    async def query(self, _id: int, node: str) -> Union[Tuple[int, str, datetime], None]:
+        '''
+        Query specific data using ID from a specific node, see LogosCluster.query
+        '''
+        return await self._run(node, self.cluster.query, _id, node)
+
+    async def query_by_ids(self, row_ids: List[int], node: str) -> List[Tuple[int, str, datetime]]:
+        '''
+        Query rows by IDs from a specific node, see LogosCluster.query_by_ids
+        '''
+        return await self._run(node, self.cluster.query_by_ids, row_ids, node)
+
+    async def query_nodes_by_ids(self, node_ids: Dict[str, List[int]]) -> Dict[str, List[Tuple[int, str, datetime]]]:
+        '''
+        Query rows by IDs from several nodes concurrently, see LogosCluster.query_nodes_by_ids
+        '''
+        results = await asyncio.gather(*(self.query_by_ids(row_ids, node) for node, row_ids in node_ids.items()))
+        return dict(zip(node_ids, results))
+
+    async def query_by_doc_ids(self, doc_ids: List[int]) -> List[Tuple[int, str, datetime]]:
+        '''
+        Query rows of any nodes by global doc IDs concurrently, see LogosCluster.query_by_doc_ids
+        '''
+        node_rows = await self.query_nodes_by_ids(self.cluster._group_doc_ids(doc_ids))
+        return self.cluster._assemble_docs(doc_ids, node_rows)
+
+    async def search(self, query: str, top_k: int = 5, nodes: Union[List[str], None] = None) -> List[Dict[str, str]]:
+        '''
+        BM25 keyword search over several nodes concurrently, see LogosCluster.search
+        '''
+        match = self.cluster._fts_match(query)
+        if match is None:
+            return []
+
+        nodes = self.nodes if nodes is None else nodes
+        results = await asyncio.gather(*(self._run(node, self.cluster._search_node, match, node, top_k) for node in nodes))
+        hits = [hit for result in results for hit in result]
+        return sorted(hits, key=lambda hit: hit['Score'], reverse=True)[:top_k]
+
+    def query_chunk(self, node: str, CHUNK_SIZE: int = 1000, after_id: int = 0, until_id: Union[int, None] = None) -> 'AsyncChunkCursor':
+        '''
+        Query all data from a specific node in chunks with async for, see LogosCluster.query_chunk
+
+        Only one page is fetched at a time, the returned iterator exposes last_id to resume from.
+        '''
+        return AsyncChunkCursor(self, node, CHUNK_SIZE, after_id, until_id)
+
+    async def insert_batch(self, data: List[Tuple[str, str]], node: str, upsert: bool = False) -> bool:
+        '''
+        Insert data into 1 node in batch, see LogosCluster.insert_batch
+        '''
+        return await self._run(node, self.cluster.insert_batch, data, node, upsert)
+
+
+class AsyncChunkCursor:
+    '''
+    Async keyset-paginated iterator over the rows of a node, see AsyncLogosCluster.query_chunk
+    '''
+
+    def __init__(self, cluster: AsyncLogosCluster, node: str, chunk_size: int, after_id: int = 0, until_id: Union[int, None] = None) -> None:
+        self.cluster = cluster
+        self.node = node
+        self.chunk_size = chunk_size
+        self.until_id = MAX_ROW_ID if until_id is None else until_id
+        self.last_id = after_id
+
+    async def __aiter__(self) -> AsyncIterator[List[Tuple[int, str, datetime]]]:
+        try:
+            while True:
+                rows = await self.cluster._run(self.node, self.cluster.cluster._select_page,
+                                               self.node, self.last_id, self.until_id, self.chunk_size)
+                if not rows:
+                    break
+                self.last_id = rows[-1][0]
+                yield rows
+
+        except Exception as e:
+            print(f'Error at AsyncLogosCluster query_chunk: {e}')
+            return
@@ -0,0 +1,216 @@
+from typing import Dict, Tuple, Union
+from urllib.parse import quote
+import os
+import sqlite3
+import threading
+
+'''
+This file contains the ClusterCatalog class, a small SQLite database stored next to the nodes of a LogosCluster.
+
+It holds cluster-wide metadata that does not belong to a single node, such as the shard routing table,
+the trained compression dictionaries, the change-feed high-water marks, per-node statistics and the topic ID registry.
+'''
+
+CATALOG_FILE = '_catalog.db'
+
+# seconds to wait on a locked catalog before raising, several writer processes may share it
+BUSY_TIMEOUT = 30
+
+# table name -> column definitions
+TABLES = {
+    'shards': 'Node TEXT PRIMARY KEY, NumShards INTEGER NOT NULL, NextID INTEGER NOT NULL',
+    'codecs': 'Node TEXT PRIMARY KEY, Kind TEXT NOT NULL, Dictionary BLOB NOT NULL',
+    'watermarks': 'Node TEXT NOT NULL, Consumer TEXT NOT NULL, UpdatedAt TEXT NOT NULL, ID INTEGER NOT NULL, PRIMARY KEY (Node, Consumer)',
+    'stats': 'Node TEXT PRIMARY KEY, Rows INTEGER NOT NULL, MinID INTEGER, MaxID INTEGER, ContentBytes INTEGER NOT NULL, LastUpdated TEXT',
+    'topics': 'Node TEXT PRIMARY KEY, TopicID INTEGER UNIQUE NOT NULL',
+}
+
+# stats are (Rows, MinID, MaxID, ContentBytes, LastUpdated), MinID/MaxID/LastUpdated are NULL for an empty node
+NodeStats = Tuple[int, Union[int, None], Union[int, None], int, Union[str, None]]
+
+
+class ClusterCatalog:
+    def __init__(self, data_dir: str, read_only: bool = False) -> None:
+        self.path = os.path.join(data_dir, CATALOG_FILE)
+        self.read_only = read_only
+
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # the connection is reopened lazily in the receiving process
+        return {'path': self.path, 'read_only': self.read_only}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(os.path.dirname(state['path']), state.get('read_only', False))
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None and self.read_only:
+            # never created or locked, tables missing from an older catalog read as empty temp tables
+            uri = f'file:{quote(os.path.abspath(self.path))}?mode=ro&immutable=1'
+            self._conn = sqlite3.connect(uri, uri=True, isolation_level=None, check_same_thread=False)
+            stored = {row[0] for row in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for name, columns in TABLES.items():
+                if name not in stored:
+                    self._conn.execute(f'CREATE TEMP TABLE {name} ({columns})')
+
+        elif self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # autocommit mode, multi-statement updates open their own transaction
+            self._conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT,
+                                         isolation_level=None, check_same_thread=False)
+            for name, columns in TABLES.items():
+                self._conn.execute(f'CREATE TABLE IF NOT EXISTS {name} ({columns})')
+        return self._conn
+
+    def _writable(self) -> sqlite3.Connection:
+        if self.read_only:
+            raise PermissionError('ClusterCatalog: catalog is opened read-only')
+        return self._connect()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def shard_routes(self) -> Dict[str, int]:
+        '''
+        Get the number of shards of every sharded node, unsharded nodes are not listed
+        '''
+        if not self.exists():
+            return {}
+
+        with self._lock:
+            return dict(self._connect().execute('SELECT Node, NumShards FROM shards').fetchall())
+
+    def set_shards(self, node: str, num_shards: int, next_id: int) -> None:
+        with self._lock:
+            self._writable().execute(
+                'INSERT OR REPLACE INTO shards (Node, NumShards, NextID) VALUES (?, ?, ?)', (node, num_shards, next_id))
+
+    def allocate_ids(self, node: str, count: int) -> int:
+        '''
+        Reserve count consecutive row IDs for a sharded node, return the first one
+        '''
+        with self._lock:
+            conn = self._writable()
+            # BEGIN IMMEDIATE takes the write lock up front so concurrent allocators serialize
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT NextID FROM shards WHERE Node = ?', (node,)).fetchone()
+                if row is None:
+                    raise KeyError(f'ClusterCatalog: node {node} is not sharded')
+                conn.execute('UPDATE shards SET NextID = ? WHERE Node = ?', (row[0] + count, node))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return row[0]
+
+    def get_codec(self, node: str) -> Union[Tuple[str, bytes], None]:
+        '''
+        Get the (kind, dictionary) pair used to compress a node, None if it was never compressed
+        '''
+        if not self.exists():
+            return None
+
+        with self._lock:
+            return self._connect().execute('SELECT Kind, Dictionary FROM codecs WHERE Node = ?', (node,)).fetchone()
+
+    def set_codec(self, node: str, kind: str, dictionary: bytes) -> Tuple[str, bytes]:
+        '''
+        Store the codec of a node unless one exists, return the one that is stored
+        '''
+        with self._lock:
+            conn = self._writable()
+            # a node's dictionary never changes, rows compressed with it must stay readable
+            conn.execute('INSERT OR IGNORE INTO codecs (Node, Kind, Dictionary) VALUES (?, ?, ?)', (node, kind, dictionary))
+            return conn.execute('SELECT Kind, Dictionary FROM codecs WHERE Node = ?', (node,)).fetchone()
+
+    def get_watermark(self, node: str, consumer: str) -> Union[Tuple[str, int], None]:
+        '''
+        Get the (UpdatedAt, ID) of the last row a consumer processed in a node, None if it never ran
+        '''
+        if not self.exists():
+            return None
+
+        with self._lock:
+            return self._connect().execute(
+                'SELECT UpdatedAt, ID FROM watermarks WHERE Node = ? AND Consumer = ?', (node, consumer)).fetchone()
+
+    def set_watermark(self, node: str, consumer: str, updated_at: str, _id: int) -> None:
+        with self._lock:
+            self._writable().execute(
+                'INSERT OR REPLACE INTO watermarks (Node, Consumer, UpdatedAt, ID) VALUES (?, ?, ?, ?)', (node, consumer, updated_at, _id))
+
+    def get_stats(self) -> Dict[str, NodeStats]:
+        '''
+        Get the statistics of every node, nodes never counted are not listed
+        '''
+        if not self.exists():
+            return {}
+
+        with self._lock:
+            rows = self._connect().execute('SELECT Node, Rows, MinID, MaxID, ContentBytes, LastUpdated FROM stats').fetchall()
+            return {row[0]: row[1:] for row in rows}
+
+    def set_stats(self, node: str, stats: NodeStats) -> None:
+        with self._lock:
+            self._writable().execute(
+                'INSERT OR REPLACE INTO stats (Node, Rows, MinID, MaxID, ContentBytes, LastUpdated) VALUES (?, ?, ?, ?, ?, ?)', (node, *stats))
+
+    def add_stats(self, node: str, delta: NodeStats) -> None:
+        '''
+        Fold the statistics of newly committed rows into a node's statistics
+        '''
+        with self._lock:
+            # one statement, so concurrent writer processes never lose an update;
+            # scalar MIN/MAX return NULL if either side is NULL, COALESCE falls back to the other side
+            self._writable().execute(
+                '''INSERT INTO stats (Node, Rows, MinID, MaxID, ContentBytes, LastUpdated) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (Node) DO UPDATE SET
+                    Rows = Rows + excluded.Rows,
+                    MinID = COALESCE(MIN(MinID, excluded.MinID), MinID, excluded.MinID),
+                    MaxID = COALESCE(MAX(MaxID, excluded.MaxID), MaxID, excluded.MaxID),
+                    ContentBytes = ContentBytes + excluded.ContentBytes,
+                    LastUpdated = COALESCE(MAX(LastUpdated, excluded.LastUpdated), LastUpdated, excluded.LastUpdated)''',
+                (node, *delta))
+
+    def topic_ids(self) -> Dict[str, int]:
+        '''
+        Get the numeric topic ID of every registered node
+        '''
+        if not self.exists():
+            return {}
+
+        with self._lock:
+            return dict(self._connect().execute('SELECT Node, TopicID FROM topics').fetchall())
+
+    def register_topic(self, node: str, preferred: int, max_id: int) -> int:
+        '''
+        Give a node the topic ID preferred (its name hash) unless it has one, return its topic ID
+
+        A preferred ID held by another node is a hash collision, the node then takes the next free ID up to max_id.
+        '''
+        with self._lock:
+            conn = self._writable()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # IDs are never reassigned, global doc IDs stored elsewhere must stay valid
+                row = conn.execute('SELECT TopicID FROM topics WHERE Node = ?', (node,)).fetchone()
+                if row is None:
+                    topic_id = preferred
+                    while conn.execute('SELECT 1 FROM topics WHERE TopicID = ?', (topic_id,)).fetchone():
+                        topic_id = topic_id % max_id + 1
+                    conn.execute('INSERT INTO topics (Node, TopicID) VALUES (?, ?)', (node, topic_id))
+                else:
+                    topic_id = row[0]
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return topic_id
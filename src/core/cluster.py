@@ -1,23 +1,277 @@
-from typing import Iterator, List, Tuple, Union
-from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
+import hashlib
 import os
-import sqlite3
+import re
+import threading
 import time
-import multiprocessing as mp
 import pandas as pd
+from . import arrow_io
+from .catalog import ClusterCatalog, NodeStats
+from .compression import ContentCodec, TRAIN_SAMPLES
+from .connection import NodeConnectionManager
+from .ingest import IngestEngine
+from .row_cache import RowCache
+from .rpc import DEFAULT_AUTHKEY, Address, RemoteNode, parse_address
 
 '''
 This file contains the LogosCluster class, which is responsible for building a distributed system of SQLite databases.
 '''
 
+# auto_insert(bulk_load=True) settings
+BULK_SYNCHRONOUS = 'OFF'  # use 'NORMAL' to survive OS crashes during the load at some speed cost
+BULK_CACHE_KIB = 256 * 1024  # page cache per node writer
+
+# upper bound used when query_chunk has no until_id
+MAX_ROW_ID = 2 ** 63 - 1
+
+# threads used by query_nodes_by_ids to fan out over nodes
+DEFAULT_MAX_WORKERS = 8
+
+# query_by_ids binds IDs in groups padded to one of these sizes, one cached statement per size
+ID_GROUP_SIZES = (8, 64, 512)
+
+# default byte budget of the row cache, see LogosCluster(cache_rows=...)
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# rows copied per transaction when rebalance splits a node into shards
+REBALANCE_CHUNK_SIZE = 10000
+
+# bytes of the blake2b digest stored in ContentHash
+CONTENT_HASH_SIZE = 16
+
+# global doc ID layout: topic ID in the high bits, row ID in the low TOPIC_ID_SHIFT bits, fits a signed int64
+TOPIC_ID_SHIFT = 40
+ROW_ID_MASK = (1 << TOPIC_ID_SHIFT) - 1
+MAX_TOPIC_ID = (1 << (63 - TOPIC_ID_SHIFT)) - 1
+
+
+def shard_name(node: str, shard: int) -> str:
+    '''
+    Name of the database file (without .db) holding one shard of a node
+    '''
+    return f'{node}.shard{shard}'
+
+
+def make_doc_id(topic_id: int, row_id: int) -> int:
+    '''
+    Pack a topic ID and a row ID into one 64-bit global doc ID
+    '''
+    if not 0 < topic_id <= MAX_TOPIC_ID or not 0 <= row_id <= ROW_ID_MASK:
+        raise ValueError(f'LogosCluster: topic ID {topic_id} / row ID {row_id} out of the doc ID range')
+    return (topic_id << TOPIC_ID_SHIFT) | row_id
+
+
+def stable_topic_id(node: str) -> int:
+    '''
+    Topic ID a node is given unless it collides with another node's: a hash of its name, so a node keeps
+    its doc IDs whatever order topics are registered in, and across rebuilt catalogs and deployments
+    '''
+    digest = hashlib.blake2b(node.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % MAX_TOPIC_ID + 1
+
+
+def later_stamp(stamp: str) -> str:
+    '''
+    Smallest ISO timestamp after stamp (1 microsecond later, same date/time separator), stamp itself if it is not an ISO timestamp
+    '''
+    try:
+        return (datetime.fromisoformat(stamp) + timedelta(microseconds=1)).isoformat(stamp[10] if len(stamp) > 10 else 'T')
+    except ValueError:
+        return stamp
+
+
+def split_doc_id(doc_id: int) -> Tuple[int, int]:
+    '''
+    Unpack a global doc ID into (topic ID, row ID)
+    '''
+    return doc_id >> TOPIC_ID_SHIFT, doc_id & ROW_ID_MASK
+
+
+def merge_stats(a: NodeStats, b: NodeStats) -> NodeStats:
+    '''
+    Combine the (Rows, MinID, MaxID, ContentBytes, LastUpdated) statistics of two disjoint sets of rows
+    '''
+    def pick(func, x, y):
+        return y if x is None else x if y is None else func(x, y)
+
+    return (a[0] + b[0], pick(min, a[1], b[1]), pick(max, a[2], b[2]), a[3] + b[3], pick(max, a[4], b[4]))
+
+
+def content_hash(content: str) -> bytes:
+    '''
+    Digest of a paragraph's plain text, the deduplication key of a node
+    '''
+    return hashlib.blake2b(str(content).encode('utf-8'), digest_size=CONTENT_HASH_SIZE).digest()
+
 class LogosCluster:
-    def __init__(self, data_dir: str='cluster_data') -> None:
+    def __init__(self, data_dir: str='cluster_data', max_workers: int = DEFAULT_MAX_WORKERS, compress: bool = False, fts: bool = False,
+                 cache_rows: int = 0, cache_bytes: int = DEFAULT_CACHE_BYTES, read_only: bool = False,
+                 placement: Union[Dict[str, str], None] = None) -> None:
         self.nodes = []
         self.data_dir = data_dir
         self.table_name = 'test_table'  # assume that the table in each node is the same
 
         self.input_file = None
 
+        # SQL text is built once so every call hits the connection's statement cache
+        # rows whose ContentHash is already stored in the node are skipped
+        self._sql_insert = f'INSERT INTO {self.table_name} (Content, UpdatedAt, ContentHash) VALUES (?, ?, ?) ON CONFLICT (ContentHash) DO NOTHING'
+        self._sql_insert_with_id = f'INSERT INTO {self.table_name} (ID, Content, UpdatedAt, ContentHash) VALUES (?, ?, ?, ?) ON CONFLICT (ContentHash) DO NOTHING'
+        self._sql_touch = f'UPDATE {self.table_name} SET UpdatedAt = ? WHERE ContentHash = ?'
+        self._sql_columns = 'ID, Content, UpdatedAt'  # the row schema handed out by every query
+        self._sql_select_one = f'SELECT {self._sql_columns} FROM {self.table_name} WHERE ID = ?'
+        self._sql_select_all = f'SELECT {self._sql_columns} FROM {self.table_name}'
+        self._sql_select_ids = {}  # group size -> SQL text, see ID_GROUP_SIZES
+        self._sql_select_page = f'SELECT {self._sql_columns} FROM {self.table_name} WHERE ID > ? AND ID <= ? ORDER BY ID LIMIT ?'
+        self._sql_select_since = f'SELECT {self._sql_columns} FROM {self.table_name} WHERE (UpdatedAt, ID) > (?, ?) ORDER BY UpdatedAt, ID LIMIT ?'
+
+        # bounded thread pool for per-node fan-out, created on first use
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        # serving mode for nodes nobody writes to: immutable, memory-mapped, lock-free reads, every write fails
+        self.read_only = read_only
+        self._conns = NodeConnectionManager(self.data_dir, read_only)
+
+        # cluster-wide metadata, e.g. the shard routing table (node -> number of shards)
+        self.catalog = ClusterCatalog(self.data_dir, read_only)
+        self._routes = None
+
+        # compress Content of newly written rows with a per-node dictionary, trained once the node has
+        # TRAIN_SAMPLES rows (earlier rows stay plain until compress_node), reads always decompress
+        self.compress = compress
+        self._codecs = {}
+
+        # keep an FTS5 index of Content in every node, used by search
+        self.fts = fts
+        self._fts_table = f'{self.table_name}_fts'
+        self._sql_fts_search = f'SELECT rowid, bm25({self._fts_table}) FROM {self._fts_table} WHERE {self._fts_table} MATCH ? ORDER BY 2 LIMIT ?'
+
+        # input units (e.g. csv byte ranges) a node has fully written, committed with their rows, see auto_insert(resume=True)
+        self._progress_table = 'ingest_progress'
+
+        # LRU cache of decoded rows in front of query/query_by_ids, disabled when cache_rows is 0
+        self._cache = RowCache(cache_rows, cache_bytes) if cache_rows > 0 else None
+
+        # statistics of written but uncommitted rows per node, folded into the catalog on commit
+        self._pending_stats: Dict[str, NodeStats] = {}
+        self._stats_lock = threading.Lock()
+
+        # nodes served by a NodeServer (node -> address), every other node is a local file, see set_placement
+        self.placement: Dict[str, Address] = {}
+        self.authkey = DEFAULT_AUTHKEY
+        self._remotes: Dict[Address, RemoteNode] = {}
+        self._remotes_lock = threading.Lock()
+        if placement:
+            self.set_placement(placement)
+
+        # topic registry (node -> numeric topic ID) behind global doc IDs, loaded from the catalog on first use
+        self._topic_ids: Dict[str, int] = {}
+        self._topic_nodes: Dict[int, str] = {}
+
+    def __enter__(self) -> 'LogosCluster':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __getstate__(self) -> dict:
+        # connections cannot cross process boundaries (mp.Pool pickles this instance),
+        # each process opens its own on first use
+        state = self.__dict__.copy()
+        for key in ('_conns', '_executor', '_executor_lock', '_codecs', '_pending_stats', '_stats_lock', '_remotes', '_remotes_lock'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._codecs = {}
+        self._pending_stats = {}
+        self._stats_lock = threading.Lock()
+        self._remotes = {}
+        self._remotes_lock = threading.Lock()
+        self._conns = NodeConnectionManager(self.data_dir, self.read_only)
+
+    def close(self) -> None:
+        '''
+        Close all pooled node connections and the fan-out thread pool, both are recreated lazily if used again
+        '''
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        self._conns.close()
+        self.catalog.close()
+        with self._remotes_lock:
+            for remote in self._remotes.values():
+                remote.close()
+            self._remotes = {}
+
+    def release_thread(self) -> None:
+        '''
+        Close the calling thread's pooled read connections, e.g. when a thread serving one client ends
+        '''
+        self._conns.release_thread()
+
+    def warm_up(self, nodes: Union[List[str], None] = None) -> int:
+        '''
+        Pre-load node files into the OS page cache, meant for startup in read_only mode, return the bytes read
+        '''
+        start = time.perf_counter()
+        nodes = self.nodes if nodes is None else nodes
+        total = sum(self._conns.warm_up(db) for db in self._dbs_of(nodes))
+        print(f'Warmed up {len(nodes)} nodes ({total / 2**20:,.1f} MiB) in {time.perf_counter() - start:.2f} seconds')
+        return total
+
+    def cache_stats(self) -> Dict[str, int]:
+        '''
+        Row cache counters: hits, misses, evictions, invalidations, rows and bytes held
+        '''
+        if self._cache is None:
+            return {}
+        return self._cache.stats()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='logos-node')
+            return self._executor
+
+    def refresh_routing(self) -> None:
+        '''
+        Reload the shard routing table, needed after another process rebalanced a node
+        '''
+        self._routes = None
+
+    def _num_shards(self, node: str) -> int:
+        if self._routes is None:
+            self._routes = self.catalog.shard_routes()
+        return self._routes.get(node, 1)
+
+    def _shard_names(self, node: str) -> List[str]:
+        '''
+        Database names backing a node, the node itself unless it is sharded
+        '''
+        num_shards = self._num_shards(node)
+        if num_shards == 1:
+            return [node]
+        return [shard_name(node, i) for i in range(num_shards)]
+
+    def _shard_of(self, node: str, _id: int) -> str:
+        # sharded nodes route rows by ID hash
+        num_shards = self._num_shards(node)
+        if num_shards == 1:
+            return node
+        return shard_name(node, int(_id) % num_shards)
+
     def set_metadata(self, metadata_file: str) -> None:
         '''
         Set metadata file for the cluster
@@ -29,6 +283,107 @@ class LogosCluster:
         with open(metadata_file, 'r') as f:
             self.nodes = f.read().splitlines()
 
+    def set_placement(self, placement: Dict[str, str], authkey: bytes = DEFAULT_AUTHKEY) -> None:
+        '''
+        Set which nodes live on a NodeServer: dict of node name -> 'host:port' (or a Unix socket path)
+
+        Remote nodes support the query, query_chunk, search, insert and auto_insert paths plus build_cluster and stats.
+        Maintenance (rebalance, compress_node, build_fts, refresh_stats, export) runs on the server's own cluster.
+        '''
+        self.close()
+        self.placement = {node: parse_address(address) for node, address in placement.items()}
+        self.authkey = authkey
+
+    def set_placement_file(self, placement_file: str) -> None:
+        '''
+        Set the placement from a file with one 'node address' pair per line
+        '''
+        if not os.path.exists(placement_file):
+            raise FileNotFoundError(
+                f'{placement_file} not found, terminating the program')
+
+        with open(placement_file, 'r') as f:
+            self.set_placement(dict(line.rsplit(maxsplit=1) for line in f.read().splitlines() if line.strip()))
+
+    def _remote(self, node: str) -> Union[RemoteNode, None]:
+        '''
+        Client of the server holding a node, None for local nodes
+        '''
+        address = self.placement.get(node)
+        if address is None:
+            return None
+
+        with self._remotes_lock:
+            remote = self._remotes.get(address)
+            if remote is None:
+                remote = self._remotes[address] = RemoteNode(address, self.authkey)
+            return remote
+
+    def _load_topics(self) -> None:
+        topic_ids = self.catalog.topic_ids()
+        taken = set(topic_ids.values())
+        # nodes never registered (e.g. read-only clusters built before the registry) resolve by their stable ID
+        for node in self.nodes:
+            if node not in topic_ids and stable_topic_id(node) not in taken:
+                topic_ids[node] = stable_topic_id(node)
+                taken.add(topic_ids[node])
+        self._topic_ids = topic_ids
+        self._topic_nodes = {topic_id: node for node, topic_id in topic_ids.items()}
+
+    def topic_id(self, node: str) -> int:
+        '''
+        Numeric topic ID of a node, registered in the catalog on first use (see stable_topic_id)
+        '''
+        topic_id = self.catalog.topic_ids().get(node)
+        if topic_id is None:
+            topic_id = self.catalog.register_topic(node, stable_topic_id(node), MAX_TOPIC_ID)
+            self._load_topics()
+        return topic_id
+
+    def find_topic_id(self, node: str) -> Union[int, None]:
+        '''
+        Numeric topic ID of a node without registering it: the registered one, else its stable ID,
+        None if another node holds that; never writes the catalog, safe on read paths
+        '''
+        topic_id = self._topic_ids.get(node)
+        if topic_id is None:
+            self._load_topics()
+            topic_id = self._topic_ids.get(node)
+        if topic_id is None and stable_topic_id(node) not in self._topic_nodes:
+            topic_id = stable_topic_id(node)
+        return topic_id
+
+    def topic_of(self, topic_id: int) -> Union[str, None]:
+        '''
+        Node registered under a topic ID, None if the ID is unknown
+        '''
+        node = self._topic_nodes.get(topic_id)
+        if node is None:
+            self._load_topics()
+            node = self._topic_nodes.get(topic_id)
+        return node
+
+    def doc_id(self, node: str, row_id: int) -> int:
+        '''
+        Global doc ID of a row, unique across the whole cluster
+        '''
+        return make_doc_id(self.topic_id(node), int(row_id))
+
+    def find_doc_id(self, node: str, row_id: int) -> Union[int, None]:
+        '''
+        Global doc ID of a row, None if its node was never registered (see find_topic_id)
+        '''
+        topic_id = self.find_topic_id(node)
+        return None if topic_id is None else make_doc_id(topic_id, int(row_id))
+
+    def resolve(self, doc_id: int) -> Union[Tuple[str, int], None]:
+        '''
+        (node, row ID) of a global doc ID, None if its topic is unknown
+        '''
+        topic_id, row_id = split_doc_id(int(doc_id))
+        node = self.topic_of(topic_id)
+        return None if node is None else (node, row_id)
+
     def set_input_file(self, input_file: str) -> None:
         '''
         Set data file for the cluster
@@ -48,104 +403,603 @@ class LogosCluster:
                 os.makedirs(self.data_dir)
 
             for node in self.nodes:
-                with sqlite3.connect(f'{self.data_dir}/{node}.db') as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        f'CREATE TABLE IF NOT EXISTS {self.table_name} (ID INTEGER PRIMARY KEY AUTOINCREMENT, Content TEXT, UpdatedAt DATETIME)')
-                    conn.commit()
+                self.topic_id(node)
+
+            local = [node for node in self.nodes if node not in self.placement]
+            for node in local:
+                for db in self._shard_names(node):
+                    self._create_table(db, node)
+
+            # nodes built before statistics existed are counted once
+            counted = self.catalog.get_stats()
+            self.refresh_stats([node for node in local if node not in counted])
+
+            remote_nodes = defaultdict(list)
+            for node in self.nodes:
+                if node in self.placement:
+                    remote_nodes[self.placement[node]].append(node)
+            for nodes in remote_nodes.values():
+                if not self._remote(nodes[0]).call('build_cluster', nodes):
+                    raise RuntimeError(f'LogosCluster: remote build of nodes {nodes} failed')
 
             return self.nodes
         except Exception as e:
             print(f'Error at LogosCluster build_cluster: {e}')
             return False
 
-    def insert(self, data: List[Tuple[str, str]], node: str) -> bool:
+    def _create_table(self, db: str, node: Union[str, None] = None) -> None:
+        with self._conns.write_lock(db):
+            conn = self._conns.writer(db)
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table_name} (ID INTEGER PRIMARY KEY AUTOINCREMENT, Content TEXT, UpdatedAt DATETIME, ContentHash BLOB)')
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info({self.table_name})')]
+            backfill = 'ContentHash' not in columns
+            if backfill:
+                # node built before deduplication existed
+                conn.execute(f'ALTER TABLE {self.table_name} ADD COLUMN ContentHash BLOB')
+            conn.execute(
+                f'CREATE UNIQUE INDEX IF NOT EXISTS {self.table_name}_content_hash ON {self.table_name} (ContentHash)')
+            if backfill:
+                self._backfill_hashes(conn, node or db)
+            # serves query_since, (UpdatedAt, ID) is the change-feed key
+            conn.execute(
+                f'CREATE INDEX IF NOT EXISTS {self.table_name}_updated_at ON {self.table_name} (UpdatedAt, ID)')
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {self._progress_table} (Source TEXT NOT NULL, Unit INTEGER NOT NULL, Rows INTEGER NOT NULL, PRIMARY KEY (Source, Unit))')
+            if self.fts:
+                self._create_fts_table(conn)
+            conn.commit()
+
+    def _backfill_hashes(self, conn, node: str) -> None:
+        # duplicates already stored keep a NULL hash (UPDATE OR IGNORE), only the first copy becomes the dedup key
+        last_id = 0
+        while True:
+            rows = conn.execute(self._sql_select_page, (last_id, MAX_ROW_ID, REBALANCE_CHUNK_SIZE)).fetchall()
+            if not rows:
+                return
+            conn.executemany(f'UPDATE OR IGNORE {self.table_name} SET ContentHash = ? WHERE ID = ?',
+                             [(content_hash(content), _id) for _id, content, _ in self._decode_rows(rows, node)])
+            last_id = rows[-1][0]
+
+    def _create_fts_table(self, conn) -> None:
+        # contentless: the index keeps no copy of the text, rowid is the row ID and Content stays in test_table
+        conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self._fts_table} USING fts5(Content, content='', tokenize='porter unicode61')")
+
+    def insert(self, data: List[Tuple[str, str]], node: str, upsert: bool = False) -> bool:
         '''
-        Insert data into 1 node
+        Insert data into 1 node, rows whose content the node already holds are skipped (see insert_batch)
         '''
         try:
-            for datum in data:
-                content, updated_at = datum
-                with sqlite3.connect(f'{self.data_dir}/{node}.db') as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        f'INSERT INTO {self.table_name} (Content, UpdatedAt) VALUES (?, ?)', (content, updated_at))
-                    conn.commit()
+            with self._write_transaction(node):
+                try:
+                    skipped = sum(self._append_rows([datum], node, upsert) for datum in data)
+                    self._commit(node)
+                except Exception:
+                    self._rollback(node)
+                    raise
+            if skipped:
+                print(f'[INFO] Skipped {skipped} duplicate rows of node {node}')
             return True
 
         except Exception as e:
             print(f'Error at LogosCluster insert: {e}')
             return False
 
-    def insert_batch(self, data: List[Tuple[str, str]], node: str) -> bool:
+    def insert_batch(self, data: List[Tuple[str, str]], node: str, upsert: bool = False) -> bool:
         '''
         Insert data into 1 node in batch
+
+        Rows whose content is already stored in the node (same ContentHash), or repeated within data, are skipped.
+        With upsert, the stored copy takes the UpdatedAt of the skipped row instead of being left untouched.
         '''
         try:
-            with sqlite3.connect(f'{self.data_dir}/{node}.db') as conn:
-                cursor = conn.cursor()
-                cursor.executemany(
-                    f'INSERT INTO {self.table_name} (Content, UpdatedAt) VALUES (?, ?)', data)
-                conn.commit()
+            with self._write_transaction(node):
+                try:
+                    skipped = self._append_rows(data, node, upsert)
+                    self._commit(node)
+                except Exception:
+                    self._rollback(node)
+                    raise
+            if skipped:
+                print(f'[INFO] Skipped {skipped} duplicate rows of node {node}')
             return True
 
         except Exception as e:
             print(f'Error at LogosCluster insert_batch: {e}')
             return False
 
-    def process_group(self, topic: str, data: pd.DataFrame) -> None:
+    @contextmanager
+    def _write_transaction(self, node: str):
         '''
-        Process each group of data in parallel
+        Hold the write locks of all databases of a node from the first _append_rows to its _commit or _rollback
+
+        Threads share one writer connection per database, so without this a rollback of one thread
+        would discard the uncommitted rows of another.
+        '''
+        with ExitStack() as stack:
+            for db in self._shard_names(node):
+                stack.enter_context(self._conns.write_lock(db))
+            yield
+
+    def _append_rows(self, data: List[Tuple[str, str]], node: str, upsert: bool = False,
+                     source: Union[str, None] = None, units: List[Tuple[int, int]] = ()) -> int:
+        '''
+        Write rows into the node's open write transaction without committing it, return the number of duplicates skipped
+
+        units are (unit, rows) input units of source that these rows complete, recorded in the same transaction
+        '''
+        if self._cache is not None:
+            self._cache.invalidate(node)
+
+        remote = self._remote(node)
+        if remote is not None:
+            # committed by the server right away, _commit has nothing left to do for remote nodes
+            return remote.call('insert_rows', list(data), node, upsert, source, list(units))
+
+        skipped = self._write_rows(data, node, upsert)
+        if units:
+            self._mark_units(node, source, units)
+        return skipped
+
+    def _write_rows(self, data: List[Tuple[str, str]], node: str, upsert: bool) -> int:
+        # the change feed pages by (UpdatedAt, ID), a row stamped before the node's latest change would land
+        # behind the watermarks consumers already hold, so stamps are clamped to it (new rows also get higher IDs);
+        # rows given without UpdatedAt are stamped with the current time
+        floor = self._latest_stamp(node)
+        now = datetime.now().isoformat()
+        data = [(content, self._clamp_stamp(now if updated_at is None else updated_at, floor), content_hash(content))
+                for content, updated_at in data]
+        # UpdatedAt of the rows a node holds changes with every upsert, not only with new rows;
+        # an upserted row keeps its old ID, so its stamp must be strictly after the latest change
+        touch_floor = None if floor is None else later_stamp(floor)
+        touches = [(self._clamp_stamp(updated_at, touch_floor), key) for _, updated_at, key in data] if upsert else []
+        touched = max((str(updated_at) for updated_at, _ in touches), default=None)
+        num_shards = self._num_shards(node)
+        if num_shards == 1:
+            with self._conns.write_lock(node):
+                conn = self._conns.writer(node)
+                if upsert:
+                    conn.executemany(self._sql_touch, touches)
+                last_id = conn.execute(f'SELECT MAX(ID) FROM {self.table_name}').fetchone()[0] or 0
+                inserted = conn.executemany(self._sql_insert, self._encode_rows(data, node)).rowcount
+                if self.fts:
+                    self._sync_fts(node, node)
+
+                # new rows are the ones past the previous highest ID, their hashes tell which input rows they are
+                by_key = {}
+                for row in data:
+                    by_key.setdefault(row[2], row)
+                new_rows = [(_id,) + by_key[key][:2] for _id, key in conn.execute(
+                    f'SELECT ID, ContentHash FROM {self.table_name} WHERE ID > ?', (last_id,))] if inserted else []
+            self._note_rows(node, new_rows, touched)
+            return len(data) - inserted
+
+        # a hash is only unique within one shard file, so duplicates are dropped across all shards first
+        fresh = {}
+        for row in data:
+            fresh.setdefault(row[2], row)
+        for db in self._shard_names(node):
+            with self._conns.write_lock(db):
+                conn = self._conns.writer(db)
+                if upsert:
+                    conn.executemany(self._sql_touch, touches)
+                keys = list(fresh)
+                for i in range(0, len(keys), ID_GROUP_SIZES[-1]):
+                    group = keys[i:i + ID_GROUP_SIZES[-1]]
+                    for (key,) in conn.execute(f'SELECT ContentHash FROM {self.table_name} WHERE ContentHash IN ({",".join("?" * len(group))})', group):
+                        del fresh[key]
+        if not fresh:
+            self._note_rows(node, [], touched)
+            return len(data)
+
+        # sharded nodes take IDs from the catalog so every row can be routed by its ID
+        first_id = self.catalog.allocate_ids(node, len(fresh))
+        self._note_rows(node, [(_id,) + row[:2] for _id, row in enumerate(fresh.values(), first_id)], touched)
+        rows = self._encode_rows(list(fresh.values()), node)
+        routed = defaultdict(list)
+        for _id, row in enumerate(rows, first_id):
+            routed[_id % num_shards].append((_id,) + row)
+
+        for shard, shard_rows in routed.items():
+            db = shard_name(node, shard)
+            with self._conns.write_lock(db):
+                self._conns.writer(db).executemany(self._sql_insert_with_id, shard_rows)
+                if self.fts:
+                    self._sync_fts(db, node)
+        return len(data) - len(rows)
+
+    def _latest_stamp(self, node: str) -> Union[str, None]:
+        # read on the writer connections, the open write transaction may hold newer rows than any reader sees
+        stamps = []
+        for db in self._shard_names(node):
+            with self._conns.write_lock(db):
+                stamps.append(self._conns.writer(db).execute(f'SELECT MAX(UpdatedAt) FROM {self.table_name}').fetchone()[0])
+        stamps = [str(stamp) for stamp in stamps if stamp is not None]
+        return max(stamps) if stamps else None
+
+    @staticmethod
+    def _clamp_stamp(updated_at, floor: Union[str, None]):
+        return floor if floor is not None and str(updated_at) < floor else updated_at
+
+    def _mark_units(self, node: str, source: str, units: List[Tuple[int, int]]) -> None:
+        # shards commit in order, so the last one only records a unit once all its rows are durable;
+        # rows of earlier shards committed before a crash are dropped as duplicates on resume
+        db = self._shard_names(node)[-1]
+        with self._conns.write_lock(db):
+            self._conns.writer(db).executemany(
+                f'INSERT OR REPLACE INTO {self._progress_table} (Source, Unit, Rows) VALUES (?, ?, ?)',
+                [(source, unit, rows) for unit, rows in units])
+
+    def done_units(self, source: str, node: str) -> Dict[int, int]:
+        '''
+        Get the input units of source a node has committed, unit -> rows
+        '''
+        remote = self._remote(node)
+        if remote is not None:
+            return remote.call('done_units', source, node)
+
+        done = {}
+        for db in self._shard_names(node):
+            done.update(self._conns.reader(db).execute(
+                f'SELECT Unit, Rows FROM {self._progress_table} WHERE Source = ?', (source,)).fetchall())
+        return done
+
+    def ingest_sources(self, node: str) -> List[str]:
+        '''
+        Get the checkpoint keys (see IngestEngine.source_of) a node has committed units of
+        '''
+        remote = self._remote(node)
+        if remote is not None:
+            return remote.call('ingest_sources', node)
+
+        sources = set()
+        for db in self._shard_names(node):
+            sources.update(source for (source,) in self._conns.reader(db).execute(
+                f'SELECT DISTINCT Source FROM {self._progress_table}'))
+        return sorted(sources)
+
+    def _note_rows(self, node: str, rows: List[Tuple[int, str, str]], touched: Union[str, None] = None) -> None:
+        '''
+        Add new (ID, Content, UpdatedAt) rows to the node's pending statistics, touched is the latest UpdatedAt an upsert set
+        '''
+        if not rows and touched is None:
+            return
+
+        ids = [row[0] for row in rows]
+        stamps = [str(row[2]) for row in rows] + ([touched] if touched is not None else [])
+        delta = (len(rows), min(ids, default=None), max(ids, default=None),
+                 sum(len(str(row[1]).encode('utf-8')) for row in rows), max(stamps))
+        with self._stats_lock:
+            pending = self._pending_stats.get(node)
+            self._pending_stats[node] = delta if pending is None else merge_stats(pending, delta)
+
+    def _flush_stats(self, nodes: List[str], keep: bool = True) -> None:
+        # called once the rows are committed (or rolled back, keep=False)
+        for node in nodes:
+            with self._stats_lock:
+                delta = self._pending_stats.pop(node, None)
+            if delta is not None and keep:
+                self.catalog.add_stats(node, delta)
+
+    def refresh_stats(self, nodes: Union[List[str], None] = None) -> bool:
+        '''
+        Recount the statistics of nodes (default: all nodes) from their rows, e.g. after writing to them outside LogosCluster
+        '''
+        try:
+            nodes = [node for node in (self.nodes if nodes is None else nodes) if node not in self.placement]
+            sql_summary = (f"SELECT COUNT(*), MIN(ID), MAX(ID), "
+                           f"TOTAL(CASE WHEN typeof(Content) = 'blob' THEN 0 ELSE LENGTH(CAST(Content AS BLOB)) END), "
+                           f"MAX(UpdatedAt) FROM {self.table_name}")
+            sql_compressed = f"SELECT Content FROM {self.table_name} WHERE typeof(Content) = 'blob'"
+            for node in nodes:
+                stats = (0, None, None, 0, None)
+                for db in self._shard_names(node):
+                    conn = self._conns.reader(db)
+                    rows, min_id, max_id, content_bytes, last_updated = conn.execute(sql_summary).fetchone()
+                    # compressed rows are counted by their plain text size
+                    for (blob,) in conn.execute(sql_compressed):
+                        content_bytes += len(self._codec(node).decompress(blob).encode('utf-8'))
+                    stats = merge_stats(stats, (rows, min_id, max_id, int(content_bytes), last_updated))
+                self.catalog.set_stats(node, stats)
+            return True
+
+        except Exception as e:
+            print(f'Error at LogosCluster refresh_stats: {e}')
+            return False
+
+    def stats(self) -> Dict[str, Dict[str, Union[int, float, str, None]]]:
+        '''
+        Per-node statistics read from the catalog, no node is scanned
+        Output: dict of node name -> {'rows', 'min_id', 'max_id', 'content_bytes', 'avg_length', 'last_updated'}
+
+        content_bytes and avg_length are UTF-8 bytes of the plain text, also for compressed nodes.
+        Counts are updated on every commit by insert, insert_batch and auto_insert, refresh_stats recounts a node.
+        '''
+        try:
+            stats = {node: {
+                'rows': rows,
+                'min_id': min_id,
+                'max_id': max_id,
+                'content_bytes': content_bytes,
+                'avg_length': content_bytes / rows if rows else 0.0,
+                'last_updated': last_updated
+            } for node, (rows, min_id, max_id, content_bytes, last_updated) in self.catalog.get_stats().items()
+                if node not in self.placement}
+
+            # one call per server, each returns the statistics of the nodes it serves
+            for address in set(self.placement.values()):
+                node = next(node for node, placed in self.placement.items() if placed == address)
+                served = self._remote(node).call('stats')
+                stats.update({node: value for node, value in served.items() if self.placement.get(node) == address})
+            return stats
+
+        except Exception as e:
+            print(f'Error at LogosCluster stats: {e}')
+            return {}
+
+    def _sync_fts(self, db: str, node: str) -> int:
+        '''
+        Index the rows of db that are newer than its FTS index, inside the open write transaction
+
+        Caller must hold the write lock of db. Row IDs only grow, so the highest indexed rowid is the watermark.
+        '''
+        conn = self._conns.writer(db)
+        self._create_fts_table(conn)
+        last = conn.execute(f'SELECT rowid FROM {self._fts_table} ORDER BY rowid DESC LIMIT 1').fetchone()
+        last_id = last[0] if last else 0
+
+        indexed = 0
+        while True:
+            rows = conn.execute(self._sql_select_page, (last_id, MAX_ROW_ID, REBALANCE_CHUNK_SIZE)).fetchall()
+            if not rows:
+                return indexed
+            rows = self._decode_rows(rows, node)
+            conn.executemany(f'INSERT INTO {self._fts_table} (rowid, Content) VALUES (?, ?)',
+                             [(row[0], row[1]) for row in rows])
+            last_id = rows[-1][0]
+            indexed += len(rows)
+
+    def build_fts(self, node: str) -> bool:
+        '''
+        Create the FTS5 index of a node if missing and index every row it does not cover yet
+        '''
+        try:
+            start = time.perf_counter()
+            indexed = 0
+            for db in self._shard_names(node):
+                with self._conns.write_lock(db):
+                    conn = self._conns.writer(db)
+                    try:
+                        self._create_fts_table(conn)
+                        indexed += self._sync_fts(db, node)
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+
+            print(f'Indexed {indexed} rows of node {node} for full-text search in {time.perf_counter() - start:.2f} seconds')
+            return True
+
+        except Exception as e:
+            print(f'Error at LogosCluster build_fts: {e}')
+            return False
+
+    def _codec(self, node: str, samples: Union[List[str], None] = None) -> Union[ContentCodec, None]:
+        '''
+        Get the codec of a node, training and storing one from samples if the node has none yet
+        '''
+        codec = self._codecs.get(node)
+        if codec is None:
+            stored = self.catalog.get_codec(node)
+            if stored is None:
+                if not samples:
+                    return None
+                trained = ContentCodec.train(samples)
+                stored = self.catalog.set_codec(node, trained.kind, trained.dictionary)
+            codec = self._codecs[node] = ContentCodec(*stored)
+        return codec
+
+    def _encode_rows(self, data: List[tuple], node: str) -> List[tuple]:
+        # rows start with Content, the remaining columns pass through
+        if not self.compress:
+            return data
+
+        data = list(data)
+        codec = self._codec(node)
+        if codec is None:
+            # a dictionary is kept forever, so it is only trained once the node has TRAIN_SAMPLES rows to learn from;
+            # rows stored plain until then are compressed by compress_node
+            samples = self._plain_samples(node) + [row[0] for row in data if isinstance(row[0], str)]
+            if len(samples) < TRAIN_SAMPLES:
+                return data
+            codec = self._codec(node, samples[:TRAIN_SAMPLES])
+        return [(self._encode_content(codec, row[0]),) + tuple(row[1:]) for row in data]
+
+    @staticmethod
+    def _encode_content(codec: ContentCodec, content) -> Union[bytes, None]:
+        if isinstance(content, str):
+            return codec.compress(content)
+        if content is None or content != content:
+            return None  # missing (None or NaN from pandas) is stored as NULL, as without compression
+        return codec.compress(str(content))
+
+    def _plain_samples(self, node: str) -> List[str]:
+        samples = []
+        for db in self._shard_names(node):
+            samples += [content for (content,) in self._conns.reader(db).execute(
+                f"SELECT Content FROM {self.table_name} WHERE typeof(Content) = 'text' LIMIT ?", (TRAIN_SAMPLES - len(samples),))]
+            if len(samples) >= TRAIN_SAMPLES:
+                break
+        return samples
+
+    def _decode_rows(self, rows: List[tuple], node: str) -> List[Tuple[int, str, datetime]]:
+        # compressed Content comes back as bytes, plain rows are returned untouched
+        if not any(isinstance(row[1], bytes) for row in rows):
+            return rows
+
+        codec = self._codec(node)
+        return [row[:1] + (codec.decompress(row[1]),) + row[2:] if isinstance(row[1], bytes) else row
+                for row in rows]
+
+    def compress_node(self, node: str, vacuum: bool = True) -> bool:
+        '''
+        Compress the existing plain rows of a node in place, training its dictionary first if needed
         '''
         try:
-            data['UpdatedAt'] = datetime.now().isoformat()
+            start = time.perf_counter()
+            sql_page = f"SELECT ID, Content FROM {self.table_name} WHERE ID > ? AND typeof(Content) = 'text' ORDER BY ID LIMIT ?"
+            codec = self._codec(node)
+            if codec is None:
+                samples = [row[1] for db in self._shard_names(node)
+                           for row in self._conns.reader(db).execute(sql_page, (0, TRAIN_SAMPLES))]
+                codec = self._codec(node, samples[:TRAIN_SAMPLES])
+                if codec is None:
+                    return True  # nothing to compress
 
-            # Convert DataFrame to list of tuples
-            data_tuples = list(
-                data[['content', 'UpdatedAt']].itertuples(index=False, name=None))
+            compressed = 0
+            for db in self._shard_names(node):
+                last_id = 0
+                while True:
+                    rows = self._conns.reader(db).execute(sql_page, (last_id, REBALANCE_CHUNK_SIZE)).fetchall()
+                    if not rows:
+                        break
+                    last_id = rows[-1][0]
+                    with self._conns.write_lock(db):
+                        conn = self._conns.writer(db)
+                        conn.executemany(f'UPDATE {self.table_name} SET Content = ? WHERE ID = ?',
+                                         [(self._encode_content(codec, content), _id) for _id, content in rows])
+                        conn.commit()
+                    compressed += len(rows)
+
+                if vacuum:
+                    with self._conns.write_lock(db):
+                        self._conns.writer(db).execute('VACUUM')
+
+            print(f'Compressed {compressed} rows of node {node} with {codec.kind} in {time.perf_counter() - start:.2f} seconds')
+            return True
+
+        except Exception as e:
+            print(f'Error at LogosCluster compress_node: {e}')
+            return False
+
+    def _commit(self, node: str) -> None:
+        if node in self.placement:
+            return
+        for db in self._shard_names(node):
+            with self._conns.write_lock(db):
+                self._conns.writer(db).commit()
+        self._flush_stats([node])
+
+    def _rollback(self, node: str) -> None:
+        if node in self.placement:
+            return
+        for db in self._shard_names(node):
+            with self._conns.write_lock(db):
+                self._conns.writer(db).rollback()
+        self._flush_stats([node], keep=False)
 
-            self.insert_batch(data_tuples, topic)
+    def process_group(self, topic: str, data: pd.DataFrame) -> None:
+        '''
+        Process each group of data in parallel
+        '''
+        try:
+            self.insert_batch(self._group_to_tuples(data), topic)
         except Exception as e:
             print(f'Error at LogosCluster process_group: {e}')
 
-    def auto_insert(self) -> bool:
+    def _group_to_tuples(self, data: pd.DataFrame) -> List[Tuple[str, str]]:
+        data['UpdatedAt'] = datetime.now().isoformat()
+
+        # Convert DataFrame to list of tuples
+        return list(data[['content', 'UpdatedAt']].itertuples(index=False, name=None))
+
+    def _dbs_of(self, nodes: List[str]) -> List[str]:
+        # local database files only, remote nodes are tuned by their server
+        return [db for node in nodes if node not in self.placement for db in self._shard_names(node)]
+
+    def begin_bulk_load(self, nodes: List[str]) -> None:
+        '''
+        Switch nodes to fast, non-durable settings for a bulk load
+
+        WAL journal, synchronous=OFF and a large page cache, call end_bulk_load when done
+        '''
+        for db in self._dbs_of(nodes):
+            with self._conns.write_lock(db):
+                conn = self._conns.writer(db)
+                conn.commit()
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute(f'PRAGMA synchronous={BULK_SYNCHRONOUS}')
+                conn.execute(f'PRAGMA cache_size=-{BULK_CACHE_KIB}')
+                conn.execute('PRAGMA temp_store=MEMORY')
+        self._flush_stats(nodes)
+
+    def checkpoint_bulk_load(self, nodes: List[str]) -> None:
+        '''
+        Commit the open bulk transaction of each node and fold its WAL back into the database file
+        '''
+        for db in self._dbs_of(nodes):
+            with self._conns.write_lock(db):
+                conn = self._conns.writer(db)
+                conn.commit()
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self._flush_stats(nodes)
+
+    def end_bulk_load(self, nodes: List[str]) -> None:
+        '''
+        Restore serving-safe settings after a bulk load and refresh the query planner statistics
+        '''
+        for db in self._dbs_of(nodes):
+            with self._conns.write_lock(db):
+                conn = self._conns.writer(db)
+                conn.commit()
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                conn.execute('PRAGMA journal_mode=DELETE')
+                conn.execute('PRAGMA synchronous=FULL')
+                conn.execute('PRAGMA cache_size=-2000')
+                conn.execute('ANALYZE')
+                conn.commit()
+        self._flush_stats(nodes)
+
+    def auto_insert(self, bulk_load: bool = False, num_writers: int = None, num_readers: int = None, resume: bool = False) -> bool:
         '''
         Auto insert data by chunk into a correct node in the system,
 
         Note that each topic serves as node name for now
+
+        Rows are partitioned by topic and streamed to long-lived writer processes,
+        each node is written by exactly one of them (see IngestEngine).
+
+        With bulk_load, nodes are written in WAL mode with synchronous=OFF and many batches share
+        one transaction, committed and checkpointed every BULK_COMMIT_ROWS rows.
+        Serving-safe settings are restored and ANALYZE is run once the load finishes.
+
+        With num_readers > 1 (default: half the cores), the input is cut into byte ranges on record
+        boundaries and parsed by that many reader processes, so parsing is no longer a single-core stage.
+
+        Each node records the input units (chunks or byte ranges) it has written in the same transaction
+        as their rows. With resume, units a node already committed are skipped, so a load interrupted
+        by a crash continues where it stopped instead of starting over.
         '''
         try:
             # First read the input file
             if self.input_file is None:
                 raise FileNotFoundError('LogosCluster: Input file is not set')
 
-            INPUT_CHUNK_SIZE = 10000
-
-            # the input file only have 2 cols: content and topic
-            headers = ['content', 'topic']
-            count = 0
-            with mp.Pool(mp.cpu_count()) as pool:
-                for chunk in pd.read_csv(self.input_file, chunksize=INPUT_CHUNK_SIZE, usecols=[0, 1], header=None, names=headers):
-                    print(f'Processing chunk {count}, CHUNK SIZE: {len(chunk)}')
-                    start = time.perf_counter()
-
-                    # Process 1 group at a time (single-process approach)
-                    # print(f'Processing chunk of data sequentially...')
-                    # self.process_group(chunk['topic'].iloc[0], chunk)
-                    
-                    # Process each group in parallel (multiprocessing approach)
-                    # print(f'Utilzing {mp.cpu_count()} cores to process data...')
-                    pool.starmap(self.process_group, [
-                                 (topic, data) for topic, data in chunk.groupby('topic')])
-                    count += 1
-                    print(f'Finished processing chunk {count} in {time.perf_counter() - start:.2f} seconds')
-
+            engine = IngestEngine(self, num_writers=num_writers, bulk_load=bulk_load, num_readers=num_readers)
+            engine.run(self.input_file, resume=resume)
             return True
 
         except Exception as e:
             print(f'Error at LogosCluster auto_insert: {e}')
             return False
 
+    def _print_progress(self, count: int, chunk_rows: int, start: float, total_rows: int, load_start: float) -> None:
+        elapsed = time.perf_counter() - start
+        total_elapsed = time.perf_counter() - load_start
+        print(f'Finished processing chunk {count} in {elapsed:.2f} seconds '
+              f'({chunk_rows / max(elapsed, 1e-9):,.0f} rows/s, overall {total_rows / max(total_elapsed, 1e-9):,.0f} rows/s)')
+
     def query(self, _id: int, node: str) -> Union[Tuple[int, str, datetime], None]:
         '''
         Query specific data using ID from a specific node
@@ -153,29 +1007,219 @@ class LogosCluster:
         Output: Row schema (ID: int, Content: str, UpdatedAt: datetime)
         '''
         try:
-            with sqlite3.connect(f'{self.data_dir}/{node}.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    f'SELECT * FROM {self.table_name} WHERE ID = ?', (_id,))
-                result = cursor.fetchone()
-            return result
+            if self._cache is not None:
+                row = self._cache.get(node, int(_id))
+                if row is not None:
+                    return row
+
+            remote = self._remote(node)
+            if remote is not None:
+                row = remote.call('query', int(_id), node)
+            else:
+                conn = self._conns.reader(self._shard_of(node, _id))
+                row = conn.execute(self._sql_select_one, (_id,)).fetchone()
+            if row is None:
+                return None
+
+            row = self._decode_rows([row], node)[0]
+            if self._cache is not None:
+                self._cache.put(node, row)
+            return row
 
         except Exception as e:
             print(f'Error at LogosCluster query: {e}')
             return None
         
     def query_by_ids(self, row_ids: List[int], node: str) -> List[Tuple[int, str, datetime]]:
+        '''
+        Query rows by IDs from a specific node
+        Input: list of IDs and node name
+        Output: List of rows in the order of the requested IDs, missing IDs are skipped
+        '''
         try:
-            with sqlite3.connect(f'{self.data_dir}/{node}.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    f'SELECT * FROM {self.table_name} WHERE ID IN ({",".join([str(_id) for _id in row_ids])})')
-                result = cursor.fetchall()
-            return result
+            return list(self.iter_by_ids(row_ids, node))
         except Exception as e:
             print(f'Error at LogosCluster query_by_ids: {e}')
             return []
 
+    def query_nodes_by_ids(self, node_ids: Dict[str, List[int]]) -> Dict[str, List[Tuple[int, str, datetime]]]:
+        '''
+        Query rows by IDs from several nodes concurrently on the cluster's thread pool
+        Input: dict of node name -> list of IDs
+        Output: dict of node name -> rows, as returned by query_by_ids
+
+        Latency follows the slowest node instead of the sum of all nodes.
+        '''
+        if len(node_ids) <= 1:
+            return {node: self.query_by_ids(row_ids, node) for node, row_ids in node_ids.items()}
+
+        executor = self._get_executor()
+        futures = {node: executor.submit(self.query_by_ids, row_ids, node)
+                   for node, row_ids in node_ids.items()}
+        return {node: future.result() for node, future in futures.items()}
+
+    def query_by_doc_ids(self, doc_ids: List[int]) -> List[Tuple[int, str, datetime]]:
+        '''
+        Query rows of any nodes by global doc IDs, see doc_id
+        Input: list of global doc IDs
+        Output: List of rows (DocID: int, Content: str, UpdatedAt: datetime) in the order of the requested IDs,
+        missing IDs are skipped
+
+        Nodes are queried concurrently, as in query_nodes_by_ids.
+        '''
+        try:
+            return self._assemble_docs(doc_ids, self.query_nodes_by_ids(self._group_doc_ids(doc_ids)))
+        except Exception as e:
+            print(f'Error at LogosCluster query_by_doc_ids: {e}')
+            return []
+
+    def query_doc(self, doc_id: int) -> Union[Tuple[int, str, datetime], None]:
+        '''
+        Query one row by global doc ID, the row is returned as (DocID, Content, UpdatedAt)
+        '''
+        location = self.resolve(doc_id)
+        if location is None:
+            return None
+        row = self.query(location[1], location[0])
+        return None if row is None else (int(doc_id),) + tuple(row[1:])
+
+    def _group_doc_ids(self, doc_ids: Iterable[int]) -> Dict[str, List[int]]:
+        node_ids = defaultdict(list)
+        for doc_id in doc_ids:
+            location = self.resolve(doc_id)
+            if location is not None:
+                node_ids[location[0]].append(location[1])
+        return node_ids
+
+    def _assemble_docs(self, doc_ids: List[int], node_rows: Dict[str, List[Tuple[int, str, datetime]]]) -> List[Tuple[int, str, datetime]]:
+        found = {}
+        for node, rows in node_rows.items():
+            topic_id = self.find_topic_id(node)
+            for row in rows:
+                doc_id = make_doc_id(topic_id, row[0])
+                found[doc_id] = (doc_id,) + tuple(row[1:])
+        return [found[doc_id] for doc_id in map(int, doc_ids) if doc_id in found]
+
+    def iter_by_ids(self, row_ids: Iterable[int], node: str) -> Iterator[Tuple[int, str, datetime]]:
+        '''
+        Stream rows by IDs from a specific node, in the order of the requested IDs
+
+        IDs are bound in groups of at most ID_GROUP_SIZES[-1], each group padded to a fixed size,
+        so only len(ID_GROUP_SIZES) statements are ever compiled and memory stays flat for long ID lists.
+        '''
+        group = []
+        for _id in row_ids:
+            group.append(int(_id))
+            if len(group) == ID_GROUP_SIZES[-1]:
+                yield from self._select_id_group(group, node)
+                group = []
+        if group:
+            yield from self._select_id_group(group, node)
+
+    def _select_id_group(self, group: List[int], node: str) -> List[Tuple[int, str, datetime]]:
+        found = {}
+        misses = group
+        if self._cache is not None:
+            misses = []
+            for _id in dict.fromkeys(group):
+                row = self._cache.get(node, _id)
+                if row is None:
+                    misses.append(_id)
+                else:
+                    found[_id] = row
+
+        # only cache misses go to SQLite
+        if misses:
+            fetched = {}
+            remote = self._remote(node)
+            num_shards = self._num_shards(node)
+            if remote is not None:
+                # one round trip per group
+                for row in remote.call('query_by_ids', misses, node):
+                    fetched[row[0]] = row
+            elif num_shards == 1:
+                self._select_ids(misses, node, fetched)
+            else:
+                by_shard = defaultdict(list)
+                for _id in misses:
+                    by_shard[_id % num_shards].append(_id)
+                for shard, ids in by_shard.items():
+                    self._select_ids(ids, shard_name(node, shard), fetched)
+
+            for row in self._decode_rows(list(fetched.values()), node):
+                found[row[0]] = row
+                if self._cache is not None:
+                    self._cache.put(node, row)
+
+        return [found[_id] for _id in group if _id in found]
+
+    def _select_ids(self, ids: List[int], db: str, found: dict) -> None:
+        size = next(size for size in ID_GROUP_SIZES if size >= len(ids))
+        sql = self._sql_select_ids.get(size)
+        if sql is None:
+            sql = self._sql_select_ids[size] = f'SELECT {self._sql_columns} FROM {self.table_name} WHERE ID IN ({",".join("?" * size)})'
+
+        # NULL padding never matches, it only keeps the statement text constant
+        for row in self._conns.reader(db).execute(sql, ids + [None] * (size - len(ids))):
+            found[row[0]] = row
+
+    def search(self, query: str, top_k: int = 5, nodes: Union[List[str], None] = None) -> List[Dict[str, str]]:
+        '''
+        BM25 keyword search over the FTS5 index of several nodes, run concurrently on the cluster's thread pool
+        Input: free text query, number of results, nodes to search (default: all nodes)
+        Output: List of {'ID', 'Topic', 'Content', 'Score', 'UpdatedAt'}, best first
+
+        Every word of the query is optional (OR), so natural language questions work as is.
+        Scores are negated bm25 values, higher is better.
+        '''
+        try:
+            match = self._fts_match(query)
+            if match is None:
+                return []
+
+            nodes = self.nodes if nodes is None else nodes
+            executor = self._get_executor()
+            futures = [executor.submit(self._search_node, match, node, top_k) for node in nodes]
+
+            hits = [hit for future in futures for hit in future.result()]
+            return sorted(hits, key=lambda hit: hit['Score'], reverse=True)[:top_k]
+
+        except Exception as e:
+            print(f'Error at LogosCluster search: {e}')
+            return []
+
+    @staticmethod
+    def _fts_match(query: str) -> Union[str, None]:
+        # quote every word so FTS5 operators in user text are matched literally
+        words = list(dict.fromkeys(re.findall(r'\w+', query.lower())))
+        if not words:
+            return None
+        return ' OR '.join(f'"{word}"' for word in words)
+
+    def _search_node(self, match: str, node: str, top_k: int) -> List[Dict[str, str]]:
+        try:
+            remote = self._remote(node)
+            if remote is not None:
+                return remote.call('search_node', match, node, top_k)
+
+            scores = {}
+            for db in self._shard_names(node):
+                for _id, rank in self._conns.reader(db).execute(self._sql_fts_search, (match, top_k)):
+                    scores[_id] = -rank
+
+            best = sorted(scores, key=scores.get, reverse=True)[:top_k]
+            return [{
+                'ID': _id,
+                'Topic': node,
+                'Content': content,
+                'Score': scores[_id],
+                'UpdatedAt': updated_at
+            } for _id, content, updated_at in self.query_by_ids(best, node)]
+
+        except Exception as e:
+            print(f'Error at LogosCluster search on node {node}: {e}')
+            return []
+
     def query_all(self, node: str) -> List[Tuple[int, str, datetime]]:
         '''
         [WARNING] This function is not recommended for large dataset as leading to memory issues
@@ -185,37 +1229,303 @@ class LogosCluster:
         Output: List of rows (ID: int, Content: str, UpdatedAt: datetime)
         '''
         try:
-            with sqlite3.connect(f'{self.data_dir}/{node}.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute(f'SELECT * FROM {self.table_name}')
-                result = cursor.fetchall()
-            return result
+            if node in self.placement:
+                return [row for chunk in self.query_chunk(node, REBALANCE_CHUNK_SIZE) for row in chunk]
+
+            dbs = self._shard_names(node)
+            if len(dbs) == 1:
+                return self._decode_rows(self._conns.reader(node).execute(self._sql_select_all).fetchall(), node)
+
+            rows = [row for db in dbs for row in self._conns.reader(db).execute(self._sql_select_all)]
+            return self._decode_rows(sorted(rows, key=lambda row: row[0]), node)
 
         except Exception as e:
             print(f'Error at LogosCluster query_all: {e}')
             return []
 
-    def query_chunk(self, node: str, CHUNK_SIZE: int=1000) -> Iterator[List[Tuple[int, str, datetime]]]:
+    def query_chunk(self, node: str, CHUNK_SIZE: int=1000, after_id: int = 0, until_id: Union[int, None] = None) -> 'ChunkCursor':
         '''
         Query all data from a specific node in chunks
-        Input: node name
-        Output: List of rows (ID: int, Content: str, UpdatedAt: datetime)
+        Input: node name, optionally an exclusive lower and inclusive upper ID bound
+        Output: List of rows (ID: int, Content: str, UpdatedAt: datetime), in ID order
+
+        Each chunk is fetched with its own keyset query (WHERE ID > last ID ORDER BY ID LIMIT n),
+        so no cursor stays open between chunks. The returned iterator exposes last_id,
+        the last ID handed out, which can be stored and passed back as after_id to resume.
 
         Example usage: 
-        for chunk in cluster.query_chunk(node):
+        chunks = cluster.query_chunk(node)
+        for chunk in chunks:
             for row in chunk:
-                print(row)   
+                print(row)
+            save_checkpoint(chunks.last_id)
+        '''
+        return ChunkCursor(self, node, CHUNK_SIZE, after_id, until_id)
+
+    def _select_page(self, node: str, after_id: int, until_id: Union[int, None], limit: int) -> List[Tuple[int, str, datetime]]:
+        until_id = MAX_ROW_ID if until_id is None else until_id
+        remote = self._remote(node)
+        if remote is not None:
+            return remote.call('select_page', node, after_id, until_id, limit)
+
+        dbs = self._shard_names(node)
+        if len(dbs) == 1:
+            return self._decode_rows(self._conns.reader(node).execute(
+                self._sql_select_page, (after_id, until_id, limit)).fetchall(), node)
+
+        # the smallest IDs after the key across all shards are among each shard's own first page
+        rows = [row for db in dbs for row in self._conns.reader(db).execute(
+            self._sql_select_page, (after_id, until_id, limit))]
+        rows.sort(key=lambda row: row[0])
+        return self._decode_rows(rows[:limit], node)
+
+    def query_batches(self, node: str, CHUNK_SIZE: int = 10000, after_id: int = 0, until_id: Union[int, None] = None) -> Iterator['arrow_io.pa.RecordBatch']:
+        '''
+        Query all data from a specific node as pyarrow RecordBatches (needs pyarrow)
+        Input: same as query_chunk
+        Output: RecordBatches with columns ID (int64), Content (string), UpdatedAt (string), in ID order
+
+        Unlike query_chunk, read errors are raised, a failed read never looks like the end of the node.
+        '''
+        arrow_io.require_pyarrow()
+        return (arrow_io.rows_to_batch(rows) for rows in self._pages(node, CHUNK_SIZE, after_id, until_id))
+
+    def _pages(self, node: str, chunk_size: int, after_id: int, until_id: Union[int, None]) -> Iterator[List[Tuple[int, str, datetime]]]:
+        while True:
+            rows = self._select_page(node, after_id, until_id, chunk_size)
+            if not rows:
+                return
+            after_id = rows[-1][0]
+            yield rows
+
+    def export_parquet(self, out_dir: str, nodes: Union[List[str], None] = None, CHUNK_SIZE: int = 10000,
+                       rows_per_file: int = arrow_io.ROWS_PER_FILE) -> bool:
+        '''
+        Export nodes (default: all nodes) to a Parquet dataset partitioned by topic (needs pyarrow)
+
+        Layout: out_dir/topic=<node>/part-00000.parquet, see arrow_io. Re-exporting a node replaces its files,
+        a node whose export fails keeps its previous files.
         '''
         try:
-            with sqlite3.connect(f'{self.data_dir}/{node}.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute(f'SELECT * FROM {self.table_name}')
-                while True:
-                    rows = cursor.fetchmany(CHUNK_SIZE)
-                    if not rows:
-                        break
-                    yield rows
-    
+            arrow_io.require_pyarrow()
+            nodes = self.nodes if nodes is None else nodes
+            for node in nodes:
+                start = time.perf_counter()
+                rows = arrow_io.write_node(self.query_batches(node, CHUNK_SIZE), out_dir, node, rows_per_file)
+                print(f'Exported {rows} rows of node {node} to {arrow_io.partition_dir(out_dir, node)} in {time.perf_counter() - start:.2f} seconds')
+            return True
+
+        except Exception as e:
+            print(f'Error at LogosCluster export_parquet: {e}')
+            return False
+
+    def id_ranges(self, node: str, parts: int) -> List[Tuple[int, int]]:
+        '''
+        Split a node's ID range into (after_id, until_id) pairs for query_chunk,
+        so several workers can scan one node without sharing a cursor
+        '''
+        try:
+            bounds = self._id_bounds(node)
+            if bounds is None:
+                return []
+            low, high = bounds
+
+            step = max(1, -(-(high - low + 1) // parts))
+            return [(start - 1, min(start - 1 + step, high)) for start in range(low, high + 1, step)]
+
+        except Exception as e:
+            print(f'Error at LogosCluster id_ranges: {e}')
+            return []
+
+    def _id_bounds(self, node: str) -> Union[Tuple[int, int], None]:
+        remote = self._remote(node)
+        if remote is not None:
+            return remote.call('id_bounds', node)
+
+        bounds = [self._conns.reader(db).execute(f'SELECT MIN(ID), MAX(ID) FROM {self.table_name}').fetchone()
+                  for db in self._shard_names(node)]
+        bounds = [bound for bound in bounds if bound[0] is not None]
+        if not bounds:
+            return None
+        return min(bound[0] for bound in bounds), max(bound[1] for bound in bounds)
+
+    def rebalance(self, node: str, num_shards: int) -> bool:
+        '''
+        Split a hot node in place into num_shards shard files, rows are routed by ID % num_shards
+
+        IDs are preserved, so SumDB row_ids stay valid. Run it while nothing writes to the node,
+        other processes holding this cluster must call refresh_routing afterwards.
+        '''
+        try:
+            if num_shards < 2:
+                raise ValueError('LogosCluster: a node needs at least 2 shards')
+            if self._num_shards(node) != 1:
+                raise ValueError(f'LogosCluster: node {node} is already sharded')
+
+            source_path = self._conns.node_path(node)
+            if not os.path.exists(source_path):
+                raise FileNotFoundError(f'LogosCluster: node {node} not found')
+
+            # start from empty shards, a failed earlier attempt may have left some behind
+            shards = [shard_name(node, i) for i in range(num_shards)]
+            for db in shards:
+                self._conns.close_node(db)
+                if os.path.exists(self._conns.node_path(db)):
+                    os.remove(self._conns.node_path(db))
+                self._create_table(db)
+
+            start = time.perf_counter()
+            copied = 0
+            last_id = 0
+            source = self._conns.reader(node)
+            while True:
+                # stored rows are copied as they are: compressed Content stays compressed, ContentHash is kept
+                chunk = source.execute(f'SELECT ID, Content, UpdatedAt, ContentHash FROM {self.table_name} WHERE ID > ? ORDER BY ID LIMIT ?',
+                                       (last_id, REBALANCE_CHUNK_SIZE)).fetchall()
+                if not chunk:
+                    break
+                routed = defaultdict(list)
+                for row in chunk:
+                    routed[row[0] % num_shards].append(row)
+                for shard, rows in routed.items():
+                    db = shard_name(node, shard)
+                    with self._conns.write_lock(db):
+                        conn = self._conns.writer(db)
+                        copied += conn.executemany(self._sql_insert_with_id, rows).rowcount
+                        if self.fts:
+                            self._sync_fts(db, node)
+                        conn.commit()
+                last_id = chunk[-1][0]
+
+            expected = source.execute(f'SELECT COUNT(*) FROM {self.table_name}').fetchone()[0]
+            if copied != expected:
+                raise RuntimeError(f'LogosCluster: copied {copied} of {expected} rows, node left unsharded')
+
+            # ingest checkpoints of a sharded node live in its last shard, see _mark_units
+            progress = source.execute(f'SELECT Source, Unit, Rows FROM {self._progress_table}').fetchall()
+            if progress:
+                db = shards[-1]
+                with self._conns.write_lock(db):
+                    conn = self._conns.writer(db)
+                    conn.executemany(f'INSERT OR REPLACE INTO {self._progress_table} (Source, Unit, Rows) VALUES (?, ?, ?)', progress)
+                    conn.commit()
+
+            # continue after the highest ID ever handed out, AUTOINCREMENT never reuses deleted IDs
+            max_id = source.execute(f'SELECT MAX(ID) FROM {self.table_name}').fetchone()[0] or 0
+            seq = source.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (self.table_name,)).fetchone()
+            next_id = max(max_id, seq[0] if seq else 0) + 1
+
+            self.catalog.set_shards(node, num_shards, next_id)
+            self._routes = None
+
+            # every row now lives in a shard and the node file is no longer routed to
+            self._conns.close_node(node)
+            os.remove(source_path)
+
+            print(f'Rebalanced node {node} into {num_shards} shards ({copied} rows) in {time.perf_counter() - start:.2f} seconds')
+            return True
+
+        except Exception as e:
+            print(f'Error at LogosCluster rebalance: {e}')
+            return False
+
+    def query_since(self, node: str, updated_at: str, CHUNK_SIZE: int = 1000, after_id: int = MAX_ROW_ID) -> 'ChangeCursor':
+        '''
+        Query rows of a node changed after a point in time, in chunks ordered by (UpdatedAt, ID)
+        Input: node name, UpdatedAt value (isoformat), optionally the ID of the last row already seen at that time
+        Output: List of rows (ID: int, Content: str, UpdatedAt: datetime)
+
+        With the default after_id, rows stamped exactly updated_at are skipped. The returned iterator exposes
+        last_key, the (UpdatedAt, ID) of the last row handed out, see get_watermark/set_watermark.
+
+        Writes never stamp a row before the node's latest change, so no row lands behind a watermark, see _write_rows.
+        Rows with a NULL UpdatedAt (only written outside LogosCluster) are never returned, set their UpdatedAt to include them.
+        '''
+        return ChangeCursor(self, node, CHUNK_SIZE, updated_at, after_id)
+
+    def _select_since(self, node: str, updated_at: str, after_id: int, limit: int) -> List[Tuple[int, str, datetime]]:
+        remote = self._remote(node)
+        if remote is not None:
+            return remote.call('select_since', node, updated_at, after_id, limit)
+
+        dbs = self._shard_names(node)
+        rows = [row for db in dbs for row in self._conns.reader(db).execute(
+            self._sql_select_since, (updated_at, after_id, limit))]
+        if len(dbs) > 1:
+            rows.sort(key=lambda row: (row[2], row[0]))
+            rows = rows[:limit]
+        return self._decode_rows(rows, node)
+
+    def latest_change(self, node: str) -> Union[Tuple[str, int], None]:
+        '''
+        Get the (UpdatedAt, ID) key of the most recently changed row of a node
+        '''
+        remote = self._remote(node)
+        if remote is not None:
+            return remote.call('latest_change', node)
+
+        keys = [self._conns.reader(db).execute(
+            f'SELECT UpdatedAt, ID FROM {self.table_name} ORDER BY UpdatedAt DESC, ID DESC LIMIT 1').fetchone()
+            for db in self._shard_names(node)]
+        keys = [key for key in keys if key is not None]
+        return max(keys) if keys else None
+
+    def get_watermark(self, node: str, consumer: str = 'default') -> Union[Tuple[str, int], None]:
+        '''
+        Get a consumer's high-water mark for a node: the (UpdatedAt, ID) of the last row it processed
+        '''
+        return self.catalog.get_watermark(node, consumer)
+
+    def set_watermark(self, node: str, updated_at: str, _id: int, consumer: str = 'default') -> None:
+        self.catalog.set_watermark(node, consumer, updated_at, _id)
+
+
+class ChangeCursor:
+    '''
+    Keyset-paginated iterator over the rows of a node changed after a given (UpdatedAt, ID) key, see LogosCluster.query_since
+    '''
+
+    def __init__(self, cluster: LogosCluster, node: str, chunk_size: int, updated_at: str, after_id: int) -> None:
+        self.cluster = cluster
+        self.node = node
+        self.chunk_size = chunk_size
+        self.last_key = (updated_at, after_id)
+
+    def __iter__(self) -> Iterator[List[Tuple[int, str, datetime]]]:
+        try:
+            while True:
+                rows = self.cluster._select_since(self.node, *self.last_key, self.chunk_size)
+                if not rows:
+                    break
+                self.last_key = (rows[-1][2], rows[-1][0])
+                yield rows
+
+        except Exception as e:
+            print(f'Error at LogosCluster query_since: {e}')
+            return None
+
+
+class ChunkCursor:
+    '''
+    Keyset-paginated, resumable iterator over the rows of a node, see LogosCluster.query_chunk
+    '''
+
+    def __init__(self, cluster: LogosCluster, node: str, chunk_size: int, after_id: int = 0, until_id: Union[int, None] = None) -> None:
+        self.cluster = cluster
+        self.node = node
+        self.chunk_size = chunk_size
+        self.until_id = until_id
+        self.last_id = after_id
+
+    def __iter__(self) -> Iterator[List[Tuple[int, str, datetime]]]:
+        try:
+            while True:
+                rows = self.cluster._select_page(self.node, self.last_id, self.until_id, self.chunk_size)
+                if not rows:
+                    break
+                self.last_id = rows[-1][0]
+                yield rows
+
         except Exception as e:
             print(f'Error at LogosCluster query_chunk: {e}')
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,83 @@
+from typing import List
+import threading
+import zlib
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+'''
+This file contains the ContentCodec class, which compresses the Content column of a LogosCluster node.
+
+Each node gets its own dictionary trained on its own paragraphs, so even short rows compress well.
+zstd is used when the zstandard package is installed, zlib with a preset dictionary otherwise.
+'''
+
+# first byte of every compressed value, uncompressed rows are stored as TEXT and never start with these
+ZSTD_MARKER = b'\x01'
+ZLIB_MARKER = b'\x02'
+
+ZSTD_DICT_SIZE = 112 * 1024
+ZSTD_LEVEL = 3
+ZLIB_DICT_SIZE = 32 * 1024  # zlib only looks back 32 KiB, a larger dictionary is never used
+ZLIB_LEVEL = 6
+
+TRAIN_SAMPLES = 2000  # rows used to train a node's dictionary
+
+
+class ContentCodec:
+    def __init__(self, kind: str, dictionary: bytes) -> None:
+        if kind == 'zstd' and zstd is None:
+            raise ImportError('ContentCodec: node was compressed with zstd, pip install zstandard to read it')
+
+        self.kind = kind
+        self.dictionary = dictionary
+
+        # zstd (de)compressors are not thread-safe, every thread gets its own pair
+        self._local = threading.local()
+        if kind == 'zstd':
+            self._zstd_dict = zstd.ZstdCompressionDict(dictionary)
+            self._zstd_dict.precompute_compress(level=ZSTD_LEVEL)
+
+    @classmethod
+    def train(cls, samples: List[str]) -> 'ContentCodec':
+        '''
+        Build a codec from sample paragraphs of one node
+        '''
+        encoded = [sample.encode('utf-8') for sample in samples[:TRAIN_SAMPLES] if sample]
+        if zstd is not None:
+            try:
+                dictionary = zstd.train_dictionary(ZSTD_DICT_SIZE, encoded).as_bytes()
+            except zstd.ZstdError:
+                # too few samples to train on, fall back to using them as raw content
+                dictionary = b''.join(encoded)[-ZSTD_DICT_SIZE:]
+            return cls('zstd', dictionary)
+
+        # zlib has no trainer, the most useful preset dictionary is plain sample text,
+        # with the most common strings last because they are cheapest to reference
+        return cls('zlib', b''.join(encoded)[-ZLIB_DICT_SIZE:])
+
+    def _zstd_pair(self):
+        pair = getattr(self._local, 'pair', None)
+        if pair is None:
+            pair = self._local.pair = (zstd.ZstdCompressor(level=ZSTD_LEVEL, dict_data=self._zstd_dict),
+                                       zstd.ZstdDecompressor(dict_data=self._zstd_dict))
+        return pair
+
+    def compress(self, text: str) -> bytes:
+        data = text.encode('utf-8')
+        if self.kind == 'zstd':
+            return ZSTD_MARKER + self._zstd_pair()[0].compress(data)
+
+        compressor = zlib.compressobj(ZLIB_LEVEL, zdict=self.dictionary) if self.dictionary else zlib.compressobj(ZLIB_LEVEL)
+        return ZLIB_MARKER + compressor.compress(data) + compressor.flush()
+
+    def decompress(self, blob: bytes) -> str:
+        marker, payload = blob[:1], blob[1:]
+        if marker == ZSTD_MARKER:
+            return self._zstd_pair()[1].decompress(payload).decode('utf-8')
+        if marker == ZLIB_MARKER:
+            decompressor = zlib.decompressobj(zdict=self.dictionary) if self.dictionary else zlib.decompressobj()
+            return (decompressor.decompress(payload) + decompressor.flush()).decode('utf-8')
+        raise ValueError('ContentCodec: unknown compression marker')
@@ -0,0 +1,167 @@
+from typing import Dict, List, Tuple
+from urllib.parse import quote
+import os
+import sqlite3
+import threading
+
+'''
+This file contains the NodeConnectionManager class, which keeps long-lived SQLite connections to the nodes of a LogosCluster.
+'''
+
+# number of compiled statements cached by each connection, the cluster only uses a handful of fixed SQL strings
+STATEMENT_CACHE_SIZE = 256
+
+# seconds to wait on a locked node before raising
+BUSY_TIMEOUT = 30
+
+# bytes of each node file read-only connections map into memory, SQLite clamps it to its compile-time maximum
+READ_ONLY_MMAP_SIZE = 64 * 1024 ** 3
+
+WARM_UP_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+class NodeConnectionManager:
+    '''
+    Keep one reusable connection per node instead of reconnecting on every call
+
+    - Readers get a thread-local connection per node, so concurrent readers never share a cursor
+    - Writers share one dedicated connection per node, guarded by a per-node lock
+
+    Compiled statements are reused through sqlite3's per-connection statement cache,
+    so callers should keep their SQL text constant and bind values as parameters.
+
+    With read_only, nodes are opened as immutable, memory-mapped files: SQLite takes no file locks,
+    never checks for changes by other processes and reads pages straight from the mapping.
+    Nothing may write to the node files while they are open this way.
+    '''
+
+    def __init__(self, data_dir: str, read_only: bool = False) -> None:
+        self.data_dir = data_dir
+        self.read_only = read_only
+
+        self._local = threading.local()
+        self._readers: List[Tuple[str, sqlite3.Connection]] = []
+        # bumped by close_node, a thread-local reader opened under an older generation is closed and reopened
+        self._generations: Dict[str, int] = {}
+        self._writers: Dict[str, sqlite3.Connection] = {}
+        self._write_locks: Dict[str, threading.RLock] = {}
+        self._lock = threading.Lock()
+
+    def node_path(self, node: str) -> str:
+        return os.path.join(self.data_dir, f'{node}.db')
+
+    def _connect(self, node: str) -> sqlite3.Connection:
+        # check_same_thread is off so close() can release connections owned by other threads,
+        # each connection is still only used by the thread (or lock holder) it belongs to
+        if not self.read_only:
+            return sqlite3.connect(self.node_path(node), timeout=BUSY_TIMEOUT,
+                                   cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+
+        uri = f'file:{quote(os.path.abspath(self.node_path(node)))}?mode=ro&immutable=1'
+        conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT,
+                               cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+        conn.execute(f'PRAGMA mmap_size={READ_ONLY_MMAP_SIZE}')
+        return conn
+
+    def reader(self, node: str) -> sqlite3.Connection:
+        '''
+        Get the calling thread's read connection to a node
+        '''
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+
+        generation = self._generations.get(node, 0)
+        entry = conns.get(node)
+        if entry is not None and entry[1] == generation:
+            return entry[0]
+
+        conn = self._connect(node)
+        conns[node] = (conn, generation)
+        with self._lock:
+            self._readers.append((node, conn))
+        return conn
+
+    def release_thread(self) -> None:
+        '''
+        Close the calling thread's read connections, call it before a short-lived thread ends
+        '''
+        conns = getattr(self._local, 'conns', None)
+        if not conns:
+            return
+
+        self._local.conns = {}
+        with self._lock:
+            released = {id(conn) for conn, _ in conns.values()}
+            self._readers = [(node, conn) for node, conn in self._readers if id(conn) not in released]
+        for conn, _ in conns.values():
+            conn.close()
+
+    def writer(self, node: str) -> sqlite3.Connection:
+        '''
+        Get the dedicated write connection to a node, hold write_lock(node) while using it
+        '''
+        if self.read_only:
+            raise PermissionError(f'NodeConnectionManager: node {node} is opened read-only')
+
+        with self._lock:
+            conn = self._writers.get(node)
+            if conn is None:
+                conn = self._connect(node)
+                self._writers[node] = conn
+            return conn
+
+    def write_lock(self, node: str) -> threading.RLock:
+        # re-entrant, a writer holds it across a whole transaction and again around each statement
+        with self._lock:
+            lock = self._write_locks.get(node)
+            if lock is None:
+                lock = self._write_locks[node] = threading.RLock()
+            return lock
+
+    def warm_up(self, node: str) -> int:
+        '''
+        Read a node file once from start to end so its pages are resident before the first query, return the bytes read
+
+        mmap reads then hit the OS page cache instead of faulting pages in from disk one by one.
+        '''
+        path = self.node_path(node)
+        buffer = bytearray(WARM_UP_BLOCK_SIZE)
+        total = 0
+        with open(path, 'rb', buffering=0) as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    return total
+                total += n
+
+    def close_node(self, node: str) -> None:
+        '''
+        Close the write connection and every thread's read connections to one node, e.g. before its file is replaced
+        '''
+        with self._lock:
+            self._generations[node] = self._generations.get(node, 0) + 1
+            closing = [conn for name, conn in self._readers if name == node]
+            self._readers = [(name, conn) for name, conn in self._readers if name != node]
+            writer = self._writers.pop(node, None)
+            if writer is not None:
+                closing.append(writer)
+        for conn in closing:
+            conn.close()
+
+    def close(self) -> None:
+        '''
+        Close every connection opened by this manager
+        '''
+        with self._lock:
+            for _, conn in self._readers:
+                conn.close()
+            for conn in self._writers.values():
+                conn.close()
+            self._readers = []
+            self._writers = {}
+
+        # connections of other threads are dropped lazily, they are already closed
+        self._local = threading.local()
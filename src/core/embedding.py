@@ -0,0 +1,84 @@
+from typing import List
+import os
+import threading
+import numpy as np
+
+try:
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+except ImportError:
+    torch = None
+
+'''
+This file contains the in-process text embedders used by the local SumDB backends.
+
+E5Embedder runs the same model as Marqo's hf/e5-base-v2 index, so a local index ranks like the Marqo one.
+The model is saved under models/ on first use and loaded from there afterwards, which keeps
+air-gapped boxes working once the directory is copied over.
+'''
+
+E5_MODEL_NAME = 'intfloat/e5-base-v2'
+E5_MODEL_DIR = os.path.join('models', 'e5-base-v2')
+E5_DIM = 768
+EMBED_BATCH_SIZE = 32  # texts per forward pass
+MAX_TOKENS = 512
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    '''
+    L2-normalize the rows of a matrix as float32, all-zero rows stay zero
+    '''
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+class E5Embedder:
+    '''
+    Normalized float32 e5 embeddings, texts get the 'query: ' or 'passage: ' prefix the model was trained with
+    '''
+    dim = E5_DIM
+
+    def __init__(self, model_name: str = E5_MODEL_NAME, model_dir: str = E5_MODEL_DIR, device: str = None, batch_size: int = EMBED_BATCH_SIZE) -> None:
+        self.model_name = model_name
+        self.model_dir = model_dir
+        self.device = device
+        self.batch_size = batch_size
+
+        self._model = None
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        with self._lock:
+            if self._model is not None:
+                return
+            if torch is None:
+                raise ImportError('E5Embedder: local embeddings need torch and transformers, pip install torch transformers')
+
+            if not os.path.exists(self.model_dir):
+                AutoTokenizer.from_pretrained(self.model_name).save_pretrained(self.model_dir)
+                AutoModel.from_pretrained(self.model_name).save_pretrained(self.model_dir)
+
+            self.device = self.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+            self._model = AutoModel.from_pretrained(self.model_dir).to(self.device).eval()
+
+    def embed(self, texts: List[str], kind: str = 'passage') -> np.ndarray:
+        '''
+        Embed texts into a (len(texts), dim) float32 matrix of unit vectors, kind is 'query' or 'passage'
+        '''
+        self._load()
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i in range(0, len(texts), self.batch_size):
+            batch = [f'{kind}: {text}' for text in texts[i:i + self.batch_size]]
+            tokens = self._tokenizer(batch, max_length=MAX_TOKENS, padding=True, truncation=True, return_tensors='pt').to(self.device)
+            with torch.no_grad():
+                hidden = self._model(**tokens).last_hidden_state
+
+            # mean pooling over real tokens, padding is masked out
+            mask = tokens['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1)
+            vectors[i:i + len(batch)] = torch.nn.functional.normalize(pooled, dim=-1).float().cpu().numpy()
+
+        return vectors
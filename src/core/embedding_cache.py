@@ -0,0 +1,243 @@
+from typing import Dict, List, Tuple
+from collections import OrderedDict
+import hashlib
+import os
+import sqlite3
+import threading
+import numpy as np
+
+'''
+This file contains the EmbeddingCache class, a persistent content hash -> embedding cache, and CachedEmbedder,
+which puts it in front of an embedder so unchanged texts are never embedded twice.
+
+Vectors live in fixed slots of a memory-mapped float32 file, a SQLite index maps hashes to slots.
+Keep one cache directory per embedding model, and one process per directory.
+'''
+
+DEFAULT_CACHE_BYTES = 1024 * 1024 * 1024  # vector bytes kept before least recently used entries are evicted
+INITIAL_SLOTS = 1024  # slots of the first vector file, it doubles up to the size limit
+KEY_SIZE = 16
+TICK_FLUSH_HITS = 10000  # cache hits whose recency is kept in memory before it is written to the index
+
+VECTORS_FILE = 'embeddings.f32'
+INDEX_FILE = 'index.db'
+
+
+def embedding_key(text: str, kind: str = 'passage') -> bytes:
+    # query and passage embeddings of one text differ, the kind is part of the key
+    return hashlib.blake2b(f'{kind}\0{text}'.encode('utf-8'), digest_size=KEY_SIZE).digest()
+
+
+class EmbeddingCache:
+    '''
+    Persistent LRU cache of key -> float32 vector, bounded by max_bytes of vectors
+
+    Counters: hits, misses and evictions (least recently used entries dropped to make room).
+    '''
+
+    def __init__(self, path: str, dim: int, max_bytes: int = DEFAULT_CACHE_BYTES) -> None:
+        self.path = path
+        self.dim = dim
+        self.max_slots = max(1, max_bytes // (dim * 4))
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._vectors_file = os.path.join(path, VECTORS_FILE)
+        self._conn = sqlite3.connect(os.path.join(path, INDEX_FILE), check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS cache (Key BLOB PRIMARY KEY, Slot INTEGER UNIQUE NOT NULL, Tick INTEGER NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (Name TEXT PRIMARY KEY, Value INTEGER)')
+        stored_dim = self._conn.execute("SELECT Value FROM meta WHERE Name = 'dim'").fetchone()
+        if stored_dim is not None and stored_dim[0] != dim:
+            raise ValueError(f'EmbeddingCache: {path} holds {stored_dim[0]}-d vectors, not {dim}-d')
+        self._conn.execute("INSERT OR IGNORE INTO meta (Name, Value) VALUES ('dim', ?)", (dim,))
+        self._conn.commit()
+
+        # key -> slot in least to most recently used order, restored from the ticks of the last session
+        self._slots: 'OrderedDict[bytes, int]' = OrderedDict(
+            self._conn.execute('SELECT Key, Slot FROM cache ORDER BY Tick'))
+        self._tick = self._conn.execute('SELECT COALESCE(MAX(Tick), 0) FROM cache').fetchone()[0]
+        # key -> tick of hits not written yet, see _write_ticks
+        self._hit_ticks: Dict[bytes, int] = {}
+        used = set(self._slots.values())
+        self._next_slot = max(used, default=-1) + 1
+        self._free = [slot for slot in range(self._next_slot) if slot not in used]
+
+        self._vectors = None
+        if os.path.exists(self._vectors_file) and os.path.getsize(self._vectors_file) >= dim * 4:
+            self._vectors = np.memmap(self._vectors_file, dtype=np.float32, mode='r+',
+                                      shape=(os.path.getsize(self._vectors_file) // (dim * 4), dim))
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _reserve(self, slots: int) -> np.memmap:
+        capacity = 0 if self._vectors is None else len(self._vectors)
+        if slots <= capacity:
+            return self._vectors
+
+        capacity = min(self.max_slots, max(INITIAL_SLOTS, slots, 2 * capacity))
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_file, 'r+b' if os.path.exists(self._vectors_file) else 'w+b') as f:
+            f.truncate(capacity * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_file, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        return self._vectors
+
+    def get_many(self, keys: List[bytes]) -> Tuple[np.ndarray, List[int]]:
+        '''
+        Look up keys, return a (len(keys), dim) matrix with the cached rows filled and the indexes of the misses
+        '''
+        vectors = np.zeros((len(keys), self.dim), dtype=np.float32)
+        missing = []
+        with self._lock:
+            found, slots = [], []
+            for i, key in enumerate(keys):
+                slot = self._slots.get(key)
+                if slot is None:
+                    missing.append(i)
+                    continue
+                self._slots.move_to_end(key)
+                found.append(i)
+                slots.append(slot)
+
+            if found:
+                vectors[found] = self._vectors[slots]
+                self._tick += 1
+                for i in found:
+                    self._hit_ticks[keys[i]] = self._tick
+                if len(self._hit_ticks) >= TICK_FLUSH_HITS:
+                    self._write_ticks()
+                    self._conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(missing)
+        return vectors, missing
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray) -> None:
+        '''
+        Store vectors under keys, evicting the least recently used entries once the size limit is reached
+        '''
+        with self._lock:
+            entries = {}
+            for key, vector in zip(keys, vectors):
+                if key not in self._slots:
+                    entries[key] = vector
+            # more new entries than the whole cache holds: only the last ones would survive anyway
+            entries = dict(list(entries.items())[-self.max_slots:])
+            if not entries:
+                return
+
+            slots, evicted = [], []
+            for _ in entries:
+                if self._free:
+                    slots.append(self._free.pop())
+                elif self._next_slot < self.max_slots:
+                    slots.append(self._next_slot)
+                    self._next_slot += 1
+                else:
+                    key, slot = self._slots.popitem(last=False)
+                    evicted.append(key)
+                    slots.append(slot)
+            self.evictions += len(evicted)
+
+            # evicted keys are dropped before their slots are overwritten, a crash never leaves a key on a foreign vector
+            if evicted:
+                for key in evicted:
+                    self._hit_ticks.pop(key, None)
+                self._write_ticks()
+                self._conn.executemany('DELETE FROM cache WHERE Key = ?', [(key,) for key in evicted])
+                self._conn.commit()
+
+            matrix = self._reserve(max(slots) + 1)
+            matrix[slots] = np.asarray(list(entries.values()), dtype=np.float32)
+            matrix.flush()
+
+            self._tick += 1
+            self._write_ticks()
+            self._conn.executemany('INSERT INTO cache (Key, Slot, Tick) VALUES (?, ?, ?)',
+                                   [(key, slot, self._tick) for key, slot in zip(entries, slots)])
+            self._conn.commit()
+            self._slots.update(zip(entries, slots))
+
+    def _write_ticks(self) -> None:
+        '''
+        Write the recency of pending hits into the open index transaction, caller must hold the lock and commit
+
+        Hits only reorder the in-memory LRU; their ticks are written with the next insert or eviction, on close
+        and every TICK_FLUSH_HITS hits, so a crash forgets at most that much recency, never an entry.
+        '''
+        if self._hit_ticks:
+            self._conn.executemany('UPDATE cache SET Tick = ? WHERE Key = ?',
+                                   [(tick, key) for key, tick in self._hit_ticks.items()])
+            self._hit_ticks.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hit_rate,
+                'entries': len(self._slots),
+                'bytes': len(self._slots) * self.dim * 4,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM cache')
+            self._conn.commit()
+            self._slots.clear()
+            self._hit_ticks.clear()
+            self._free = []
+            self._next_slot = 0
+            self._vectors = None
+            if os.path.exists(self._vectors_file):
+                os.remove(self._vectors_file)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            self._write_ticks()
+            self._conn.commit()
+            self._conn.close()
+
+
+class CachedEmbedder:
+    '''
+    Embedder wrapper that consults an EmbeddingCache first and only embeds the texts it misses
+
+    Example usage:
+    embedder = CachedEmbedder(E5Embedder(), EmbeddingCache('embedding_cache/e5-base-v2', E5_DIM))
+    '''
+
+    def __init__(self, embedder, cache: EmbeddingCache) -> None:
+        self.embedder = embedder
+        self.cache = cache
+        self.dim = embedder.dim
+
+    def embed(self, texts: List[str], kind: str = 'passage') -> np.ndarray:
+        keys = [embedding_key(text, kind) for text in texts]
+        vectors, missing = self.cache.get_many(keys)
+        if not missing:
+            return vectors
+
+        # a text repeated within the batch is embedded once
+        first = {}
+        for i in missing:
+            first.setdefault(keys[i], i)
+        computed = np.asarray(self.embedder.embed([texts[i] for i in first.values()], kind), dtype=np.float32)
+        self.cache.put_many(list(first), computed)
+
+        by_key = dict(zip(first, computed))
+        for i in missing:
+            vectors[i] = by_key[keys[i]]
+        return vectors
@@ -0,0 +1,502 @@
+from typing import Dict, List, Tuple
+from collections import Counter, defaultdict
+from datetime import datetime
+import csv
+import io
+import mmap
+import multiprocessing as mp
+import os
+import queue
+import time
+import zlib
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa_csv = None
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+'''
+This file contains the IngestEngine class, which loads an input csv into a LogosCluster.
+
+A reader stage partitions each input chunk by topic and sends plain (node, rows) tuples over
+bounded queues to long-lived writer processes. Every node belongs to exactly one writer,
+so no two processes ever compete for the same node's write lock.
+
+Messages are (node, rows, unit, unit_rows): unit is the input chunk or byte range the rows come from and
+unit_rows is set on the last message of a unit for that node. The writer records completed units in the
+transaction that commits their last rows, which is what IngestEngine.run(resume=True) skips on the next run.
+Batches of an unfinished unit that were committed before a crash are sent again and dropped as duplicates.
+
+With several readers, the input is memory-mapped and cut into byte ranges that end on record boundaries,
+and reader processes parse ranges in parallel (pyarrow, else polars, else the csv module).
+'''
+
+INPUT_CHUNK_SIZE = 10000
+BULK_COMMIT_ROWS = 500000  # rows between commits + WAL checkpoints with bulk_load
+WRITER_BATCH_ROWS = 5000  # rows buffered per node before a writer flushes them
+QUEUE_SIZE = 64  # messages in flight per writer before the reader blocks
+PUT_TIMEOUT = 1  # seconds between writer health checks while the reader is blocked
+RANGE_BYTES = 64 * 1024 * 1024  # input bytes parsed by a reader process at a time
+COUNT_BLOCK_BYTES = 16 * 1024 * 1024  # bytes copied out of the mapping per quote count
+
+
+def _count_quotes(mm: mmap.mmap, start: int, end: int) -> int:
+    count = 0
+    for block in range(start, end, COUNT_BLOCK_BYTES):
+        count += mm[block:min(block + COUNT_BLOCK_BYTES, end)].count(b'"')
+    return count
+
+
+def record_ranges(path: str, range_bytes: int = RANGE_BYTES) -> List[Tuple[int, int]]:
+    '''
+    Cut a csv file into (start, end) byte ranges of about range_bytes that start and end on record boundaries
+
+    A newline ends a record only outside quotes, i.e. after an even number of '"' since the range start
+    (escaped quotes are doubled, so they never change the parity). This assumes RFC 4180 quoting,
+    as written by pandas and the csv module.
+    '''
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return []
+
+        ranges = []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < size:
+                end = start + range_bytes
+                if end >= size:
+                    ranges.append((start, size))
+                    break
+
+                quotes = _count_quotes(mm, start, end)
+                while True:
+                    newline = mm.find(b'\n', end)
+                    if newline == -1:
+                        end = size
+                        break
+                    quotes += _count_quotes(mm, end, newline)
+                    end = newline + 1
+                    if quotes % 2 == 0:
+                        break
+
+                ranges.append((start, end))
+                start = end
+
+        return ranges
+
+
+def parse_range(data: bytes) -> Tuple[List[str], List[str]]:
+    '''
+    Parse csv bytes holding whole records into the (content, topic) columns, extra columns are ignored
+    '''
+    if pa_csv is not None:
+        table = pa_csv.read_csv(
+            io.BytesIO(data),
+            read_options=pa_csv.ReadOptions(autogenerate_column_names=True),
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(include_columns=['f0', 'f1'], column_types={'f0': pa.string(), 'f1': pa.string()}))
+        return table.column('f0').to_pylist(), table.column('f1').to_pylist()
+
+    if pl is not None:
+        # infer_schema_length=0 keeps every column a string
+        frame = pl.read_csv(data, has_header=False, columns=[0, 1], infer_schema_length=0)
+        return frame.to_series(0).to_list(), frame.to_series(1).to_list()
+
+    contents, topics = [], []
+    for record in csv.reader(io.StringIO(data.decode('utf-8'), newline='')):
+        if len(record) >= 2:
+            contents.append(record[0])
+            topics.append(record[1])
+    return contents, topics
+
+
+def _assigned_writer(assignment: Dict[str, int], num_writers: int, node: str) -> int:
+    # spread known nodes evenly, unknown topics fall back to a stable hash
+    writer_id = assignment.get(node)
+    if writer_id is None:
+        writer_id = zlib.crc32(node.encode('utf-8')) % num_writers
+    return writer_id
+
+
+def _send_unit(inbox: mp.Queue, node: str, rows: List[Tuple[str, str]], unit: int, batch_rows: int) -> None:
+    # only the last message of a unit carries its row count, the writer marks the unit done once that one is written
+    for i in range(0, len(rows), batch_rows):
+        last = i + batch_rows >= len(rows)
+        inbox.put((node, rows[i:i + batch_rows], unit, len(rows) if last else None))
+
+
+def _reader_main(path: str, reader_id: int, tasks: mp.Queue, inboxes: List[mp.Queue], assignment: Dict[str, int], batch_rows: int,
+                 progress: mp.Queue, done: Dict[str, Dict[int, int]]) -> None:
+    '''
+    Reader process: parse byte ranges of the input and send their rows to the writers owning each topic
+    '''
+    error = None
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+
+                index, start, end = task
+                f.seek(start)
+                contents, topics = parse_range(f.read(end - start))
+
+                updated_at = datetime.now().isoformat()
+                grouped = defaultdict(list)
+                unknown = Counter()
+                for content, topic in zip(contents, topics):
+                    # rows without a topic are dropped, as pandas groupby drops NaN keys
+                    if not topic:
+                        continue
+                    # topics without a node have no table to go to, they are counted and reported instead
+                    if topic not in assignment:
+                        unknown[topic] += 1
+                        continue
+                    grouped[topic].append((content, updated_at))
+                for topic, rows in grouped.items():
+                    if index not in done.get(topic, ()):
+                        _send_unit(inboxes[_assigned_writer(assignment, len(inboxes), topic)], topic, rows, index, batch_rows)
+
+                progress.put((reader_id, index, len(contents), unknown, None))
+
+    except Exception as e:
+        error = f'reader {reader_id}: {e}'
+
+    finally:
+        progress.put((reader_id, None, 0, None, error))
+
+
+def _writer_main(cluster, writer_id: int, inbox: mp.Queue, results: mp.Queue, bulk_load: bool, batch_rows: int, source: str) -> None:
+    '''
+    Writer process: owns a fixed set of nodes and is the only process writing to them
+
+    Rows are counted as written once committed. A node that fails is rolled back and its later rows are dropped,
+    the other nodes of the writer keep loading; every failure is reported.
+    '''
+    written = 0
+    skipped = 0
+    touched = set()
+    failed: Dict[str, str] = {}
+    pending: Dict[str, List[Tuple[str, str]]] = {}
+    completed: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    # rows appended to each node's open transaction: [written, duplicates]
+    appended: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+
+    def flush(node: str) -> None:
+        buffer = pending.pop(node, [])
+        if buffer:
+            duplicates = cluster._append_rows(buffer, node, source=source, units=completed.pop(node, ()))
+            appended[node][0] += len(buffer) - duplicates
+            appended[node][1] += duplicates
+
+    def commit(node: str) -> None:
+        nonlocal written, skipped
+        if bulk_load:
+            cluster.checkpoint_bulk_load([node])
+        else:
+            cluster._commit(node)
+        node_written, node_skipped = appended.pop(node, (0, 0))
+        written += node_written
+        skipped += node_skipped
+
+    def fail(node: str, e: Exception) -> None:
+        failed[node] = f'writer {writer_id}, node {node}: {e}'
+        pending.pop(node, None)
+        completed.pop(node, None)
+        appended.pop(node, None)
+        if node not in touched:
+            return  # never opened, e.g. a topic that is not a node
+        try:
+            cluster._rollback(node)
+        except Exception:
+            pass
+
+    error = None
+    try:
+        uncommitted = 0
+        while True:
+            item = inbox.get()
+            if item is None:
+                break
+
+            node, rows, unit, unit_rows = item
+            if node in failed:
+                continue
+            try:
+                if node not in cluster.nodes:
+                    raise KeyError('not a node of the cluster')
+                if node not in touched:
+                    touched.add(node)
+                    if bulk_load:
+                        cluster.begin_bulk_load([node])
+
+                buffer = pending.setdefault(node, [])
+                buffer.extend(rows)
+                if unit_rows is not None:
+                    completed[node].append((unit, unit_rows))
+                if len(buffer) < batch_rows:
+                    continue
+
+                uncommitted += len(buffer)
+                flush(node)
+                if not bulk_load:
+                    commit(node)
+            except Exception as e:
+                fail(node, e)
+                continue
+
+            # in bulk mode many batches share one transaction per node
+            if bulk_load and uncommitted >= BULK_COMMIT_ROWS:
+                for node in sorted(touched - set(failed)):
+                    try:
+                        commit(node)
+                    except Exception as e:
+                        fail(node, e)
+                uncommitted = 0
+
+        # each node is flushed on its own, a failing node never discards the rows of another
+        for node in sorted(touched - set(failed)):
+            try:
+                flush(node)
+                commit(node)
+            except Exception as e:
+                fail(node, e)
+
+    except Exception as e:
+        error = f'writer {writer_id}: {e}'
+        # nothing of an interrupted transaction may be committed, its unit progress included
+        for node in touched - set(failed):
+            fail(node, e)
+
+    finally:
+        if bulk_load and touched:
+            for node in sorted(touched):
+                try:
+                    cluster.end_bulk_load([node])
+                except Exception as e:
+                    failed.setdefault(node, f'writer {writer_id}, node {node}: {e}')
+        cluster.close()
+        errors = ([error] if error else []) + [failed[node] for node in sorted(failed)]
+        results.put((writer_id, written, skipped, '; '.join(errors) or None))
+
+
+class IngestEngine:
+    '''
+    Load a (content, topic) csv into a LogosCluster with one long-lived writer process per group of nodes
+    '''
+
+    def __init__(self, cluster, num_writers: int = None, queue_size: int = QUEUE_SIZE, batch_rows: int = WRITER_BATCH_ROWS, bulk_load: bool = False,
+                 num_readers: int = None, range_bytes: int = RANGE_BYTES) -> None:
+        self.cluster = cluster
+        self.num_writers = num_writers or max(1, min(mp.cpu_count(), len(cluster.nodes)))
+        self.queue_size = queue_size
+        self.batch_rows = batch_rows
+        self.bulk_load = bulk_load
+
+        # one reader parses in this process with pandas, more run as byte-range reader processes
+        self.num_readers = num_readers or max(1, mp.cpu_count() // 2)
+        self.range_bytes = range_bytes
+
+        self._assignment = {node: i % self.num_writers for i, node in enumerate(sorted(cluster.nodes))}
+        # rows of the last run whose topic is not a node of the cluster, by topic
+        self._unknown = Counter()
+
+    def writer_of(self, node: str) -> int:
+        return _assigned_writer(self._assignment, self.num_writers, node)
+
+    def _put(self, inbox: mp.Queue, item, writers: List[mp.Process]) -> None:
+        # block while the writer catches up (backpressure), but never on a dead writer
+        while True:
+            try:
+                inbox.put(item, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                if not all(w.is_alive() for w in writers):
+                    raise RuntimeError('IngestEngine: a writer process exited early')
+
+    def unit_scheme(self) -> str:
+        '''
+        How this engine cuts its input into units: byte ranges with several readers, pandas chunks with one
+        '''
+        return f'ranges:{self.range_bytes}' if self.num_readers > 1 else f'chunks:{INPUT_CHUNK_SIZE}'
+
+    def source_of(self, input_file: str, scheme: str = None) -> str:
+        '''
+        Checkpoint key of an input file: units (chunk or byte range indexes) only match for the same file and unit scheme
+        '''
+        size = os.path.getsize(input_file)
+        return f'{os.path.abspath(input_file)}:{size}:{self.unit_scheme() if scheme is None else scheme}'
+
+    def _resume_scheme(self, input_file: str) -> str:
+        # num_readers follows the CPU count, a run resumed on another machine must still cut the input like the first one
+        prefix = self.source_of(input_file, '')
+        recorded = {source[len(prefix):] for node in self.cluster.nodes
+                    for source in self.cluster.ingest_sources(node) if source.startswith(prefix)}
+        scheme = self.unit_scheme()
+        if not recorded or scheme in recorded:
+            return scheme
+        if len(recorded) > 1:
+            raise RuntimeError(f'IngestEngine: {input_file} was partly loaded with several unit schemes ({", ".join(sorted(recorded))}), cannot resume')
+
+        recorded = recorded.pop()
+        if recorded.startswith('chunks:') and recorded != f'chunks:{INPUT_CHUNK_SIZE}':
+            raise RuntimeError(f'IngestEngine: {input_file} was partly loaded in {recorded}, INPUT_CHUNK_SIZE is now {INPUT_CHUNK_SIZE}, cannot resume')
+        print(f'IngestEngine: resuming with the unit scheme of the earlier run ({recorded} instead of {scheme})')
+        return recorded
+
+    def run(self, input_file: str, resume: bool = False) -> int:
+        '''
+        Ingest the whole input file, return the number of rows written
+
+        Paragraphs a node already holds, e.g. from an earlier or overlapping ingest, are skipped and counted separately.
+        With resume, the units each node committed in an earlier run of the same file are not read again,
+        the input is cut into units the way that run did whatever num_readers is now.
+        '''
+        self._unknown = Counter()
+        scheme = self._resume_scheme(input_file) if resume else self.unit_scheme()
+        source = self.source_of(input_file, scheme)
+        done = {}
+        if resume:
+            done = {node: self.cluster.done_units(source, node) for node in self.cluster.nodes}
+            print(f'IngestEngine: resuming {source}, {sum(len(units) for units in done.values())} node units '
+                  f'({sum(sum(units.values()) for units in done.values()):,} rows) already loaded')
+
+        # the forked writers must not inherit open SQLite connections
+        self.cluster.close()
+
+        results = mp.Queue()
+        inboxes = [mp.Queue(self.queue_size) for _ in range(self.num_writers)]
+        writers = [mp.Process(target=_writer_main, args=(self.cluster, i, inboxes[i], results, self.bulk_load, self.batch_rows, source), daemon=True)
+                   for i in range(self.num_writers)]
+        for w in writers:
+            w.start()
+
+        print(f'IngestEngine: {self.num_writers} writer processes for {len(self.cluster.nodes)} nodes')
+        load_start = time.perf_counter()
+        try:
+            if scheme.startswith('ranges:'):
+                self._read_parallel(input_file, inboxes, writers, load_start, done, int(scheme.split(':')[1]))
+            else:
+                self._read_serial(input_file, inboxes, writers, load_start, done)
+        finally:
+            for i, inbox in enumerate(inboxes):
+                if writers[i].is_alive():
+                    self._put(inbox, None, [writers[i]])
+
+            written = 0
+            skipped = 0
+            errors = []
+            reported = set()
+            while len(reported) < len(writers):
+                try:
+                    writer_id, rows, duplicates, error = results.get(timeout=PUT_TIMEOUT)
+                except queue.Empty:
+                    if not any(w.is_alive() for i, w in enumerate(writers) if i not in reported):
+                        errors.append('a writer process died without reporting')
+                        break
+                    continue
+                reported.add(writer_id)
+                written += rows
+                skipped += duplicates
+                if error:
+                    errors.append(error)
+            for w in writers:
+                w.join()
+
+        elapsed = time.perf_counter() - load_start
+        print(f'IngestEngine: wrote {written:,} rows in {elapsed:.2f} seconds ({written / max(elapsed, 1e-9):,.0f} rows/s), '
+              f'skipped {skipped:,} duplicate rows')
+        if self._unknown:
+            print(f'IngestEngine: skipped {sum(self._unknown.values()):,} rows of topics that are not nodes of the cluster: '
+                  f'{", ".join(f"{topic} ({rows:,})" for topic, rows in self._unknown.most_common())}')
+        if errors:
+            raise RuntimeError(f'IngestEngine: {"; ".join(errors)}')
+
+        return written
+
+    def _read_serial(self, input_file: str, inboxes: List[mp.Queue], writers: List[mp.Process], load_start: float, done: Dict[str, Dict[int, int]]) -> None:
+        count = 0
+        total_rows = 0
+        # the input file only have 2 cols: content and topic
+        headers = ['content', 'topic']
+        for chunk in pd.read_csv(input_file, chunksize=INPUT_CHUNK_SIZE, usecols=[0, 1], header=None, names=headers):
+            print(f'Processing chunk {count}, CHUNK SIZE: {len(chunk)}')
+            start = time.perf_counter()
+
+            updated_at = datetime.now().isoformat()
+            for topic, data in chunk.groupby('topic'):
+                if topic not in self._assignment:
+                    self._unknown[topic] += len(data)
+                    continue
+                if count in done.get(topic, ()):
+                    continue
+                rows = [(content, updated_at) for content in data['content'].tolist()]
+                self._put(inboxes[self.writer_of(topic)], (topic, rows, count, len(rows)), writers)
+
+            count += 1
+            total_rows += len(chunk)
+            self.cluster._print_progress(count, len(chunk), start, total_rows, load_start)
+
+    def _read_parallel(self, input_file: str, inboxes: List[mp.Queue], writers: List[mp.Process], load_start: float, done: Dict[str, Dict[int, int]],
+                       range_bytes: int) -> None:
+        ranges = record_ranges(input_file, range_bytes)
+        num_readers = min(self.num_readers, max(1, len(ranges)))
+        parser = 'pyarrow' if pa_csv is not None else 'polars' if pl is not None else 'csv'
+        print(f'IngestEngine: {num_readers} reader processes ({parser}) for {len(ranges)} byte ranges')
+
+        # every range is queued up front, the list is small (one entry per range_bytes of input)
+        tasks = mp.Queue()
+        for index, (start, end) in enumerate(ranges):
+            tasks.put((index, start, end))
+        for _ in range(num_readers):
+            tasks.put(None)
+
+        progress = mp.Queue()
+        readers = [mp.Process(target=_reader_main, args=(input_file, i, tasks, inboxes, self._assignment, self.batch_rows, progress, done), daemon=True)
+                   for i in range(num_readers)]
+        for r in readers:
+            r.start()
+
+        total_rows = 0
+        finished = 0
+        errors = []
+        start = time.perf_counter()
+        try:
+            while finished < num_readers:
+                try:
+                    reader_id, index, rows, unknown, error = progress.get(timeout=PUT_TIMEOUT)
+                except queue.Empty:
+                    # readers block on full writer queues, a dead writer would stall them forever
+                    if not all(w.is_alive() for w in writers):
+                        raise RuntimeError('IngestEngine: a writer process exited early')
+                    if not any(r.is_alive() for r in readers):
+                        raise RuntimeError('IngestEngine: a reader process died without reporting')
+                    continue
+
+                if index is None:
+                    finished += 1
+                    if error:
+                        errors.append(error)
+                    continue
+
+                total_rows += rows
+                self._unknown.update(unknown)
+                self.cluster._print_progress(index + 1, rows, start, total_rows, load_start)
+                start = time.perf_counter()
+        finally:
+            for r in readers:
+                if r.is_alive() and (errors or finished < num_readers):
+                    r.terminate()
+                r.join()
+
+        if errors:
+            raise RuntimeError(f'IngestEngine: {"; ".join(errors)}')
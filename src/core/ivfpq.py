@@ -0,0 +1,245 @@
+from typing import List, Tuple
+import os
+import numpy as np
+from .sumdb_backends import LocalBackend
+
+'''
+This file contains IVFPQBackend, an approximate nearest-neighbour SumDB backend for large corpora.
+
+Vectors are assigned to the nearest of nlist k-means centroids (the inverted file), and the residual to
+that centroid is compressed by product quantization into m one-byte codes. A query only scans the lists
+of its nprobe nearest centroids, scores their codes with per-subspace lookup tables, and re-ranks a
+shortlist exactly against the full vectors, which stay on disk in the memory-mapped matrix.
+
+Resident memory per vector is m bytes of codes plus its list entry, instead of 4 * dim bytes.
+Until the index is trained (automatically once enough vectors are stored, or by calling train)
+searches are exact.
+'''
+
+NLIST = 1024  # coarse centroids
+PQ_M = 48  # sub-quantizers, i.e. code bytes per vector; must divide the embedding size
+PQ_KSUB = 256  # centroids per sub-quantizer, one byte per code
+NPROBE = 16  # lists scanned per query, the recall/latency knob
+RERANK_FACTOR = 32  # shortlist of top_k * RERANK_FACTOR candidates re-scored exactly
+TRAIN_SIZE = 65536  # vectors sampled to train the quantizers
+KMEANS_ITERATIONS = 20
+MIN_POINTS_PER_CENTROID = 39  # fewer training points per centroid give poor clusters
+BLOCK_ROWS = 65536  # vectors assigned or encoded per step
+
+QUANTIZER_FILE = 'ivfpq.npz'
+LISTS_FILE = 'ivf_lists.i32'
+CODES_FILE = 'pq_codes.u8'
+
+
+def nearest_centroids(x: np.ndarray, centroids: np.ndarray, block_rows: int = BLOCK_ROWS) -> np.ndarray:
+    '''
+    Index of the nearest (L2) centroid of every row of x
+    '''
+    half_norms = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), block_rows):
+        # argmin |x - c|^2 = argmax x.c - |c|^2 / 2
+        labels[start:start + block_rows] = np.argmax(x[start:start + block_rows] @ centroids.T - half_norms, axis=1)
+    return labels
+
+
+def kmeans(x: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    '''
+    Lloyd's k-means from k random rows of x, empty clusters are restarted on random rows
+    '''
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        labels = nearest_centroids(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        order = np.argsort(labels, kind='stable')
+        filled = np.flatnonzero(counts)
+        sums = np.add.reduceat(x[order], np.concatenate([[0], np.cumsum(counts)[:-1]])[filled], axis=0)
+        centroids[filled] = sums / counts[filled, None]
+
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+    return centroids
+
+
+class IVFPQBackend(LocalBackend):
+    '''
+    LocalBackend searched through an IVF-PQ index, the sidecar and the full vectors are shared with LocalBackend
+
+    Example usage:
+    backend = IVFPQBackend('sumdb_ivfpq', nlist=4096, nprobe=32)
+    sumdb = SumDB(backend=backend)
+    backend.nprobe = 64  # trade latency for recall at query time
+    '''
+
+    def __init__(self, path: str = 'sumdb_ivfpq', embedder=None, nlist: int = NLIST, m: int = PQ_M, nprobe: int = NPROBE,
+                 rerank_factor: int = RERANK_FACTOR, train_size: int = TRAIN_SIZE, auto_train: bool = True, **cache_options) -> None:
+        super().__init__(path, embedder, **cache_options)
+        if self.dim % m:
+            raise ValueError(f'IVFPQBackend: m={m} does not divide the embedding size {self.dim}')
+
+        self.nlist = nlist
+        self.m = m
+        self.nprobe = nprobe
+        self.rerank_factor = rerank_factor
+        self.train_size = train_size
+        self.auto_train = auto_train
+
+        self._quantizer_file = os.path.join(path, QUANTIZER_FILE)
+        self._lists_file = os.path.join(path, LISTS_FILE)
+        self._codes_file = os.path.join(path, CODES_FILE)
+        self._centroids = None
+        self._codebooks = None
+        self._assign = None
+        self._codes = None
+        self._lists = None
+
+        if os.path.exists(self._quantizer_file):
+            with np.load(self._quantizer_file) as quantizer:
+                self._centroids = quantizer['centroids']
+                self._codebooks = quantizer['codebooks']
+            self._open_codes(len(self._vectors) if self._vectors is not None else 0)
+
+    @property
+    def trained(self) -> bool:
+        return self._centroids is not None
+
+    def _open_codes(self, capacity: int) -> None:
+        # list assignment and PQ codes of every vector position, sized like the vector matrix
+        for name, path, dtype, shape in (('_assign', self._lists_file, np.int32, (capacity,)),
+                                         ('_codes', self._codes_file, np.uint8, (capacity, self.m))):
+            current = getattr(self, name)
+            if current is not None:
+                current.flush()
+                setattr(self, name, None)
+            if capacity == 0:
+                continue
+            with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+                f.truncate(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            setattr(self, name, np.memmap(path, dtype=dtype, mode='r+', shape=shape))
+
+    def _reserve(self, rows: int) -> np.memmap:
+        matrix = super()._reserve(rows)
+        if self.trained and (self._assign is None or len(self._assign) < len(matrix)):
+            self._open_codes(len(matrix))
+        return matrix
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        lists = nearest_centroids(vectors, self._centroids)
+        residuals = vectors - self._centroids[lists]
+        sub = self.dim // self.m
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = nearest_centroids(residuals[:, j * sub:(j + 1) * sub], self._codebooks[j])
+        return lists.astype(np.int32), codes
+
+    def _encode_positions(self, positions: np.ndarray) -> None:
+        for start in range(0, len(positions), BLOCK_ROWS):
+            block = positions[start:start + BLOCK_ROWS]
+            self._assign[block], self._codes[block] = self._encode(np.asarray(self._vectors[block]))
+        self._assign.flush()
+        self._codes.flush()
+        self._lists = None
+
+    def train(self, seed: int = 0) -> None:
+        '''
+        Train the coarse centroids and PQ codebooks on a sample of the stored vectors, then encode all of them
+
+        Call again to retrain after the corpus has drifted.
+        '''
+        with self._lock:
+            if self._size == 0:
+                raise ValueError('IVFPQBackend: nothing to train on')
+
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(self._size, min(self._size, self.train_size), replace=False))
+            x = np.asarray(self._vectors[sample])
+
+            nlist = max(1, min(self.nlist, len(x) // MIN_POINTS_PER_CENTROID))
+            centroids = kmeans(x, nlist, seed=seed)
+            residuals = x - centroids[nearest_centroids(x, centroids)]
+            sub = self.dim // self.m
+            ksub = min(PQ_KSUB, len(x))
+            codebooks = np.stack([kmeans(np.ascontiguousarray(residuals[:, j * sub:(j + 1) * sub]), ksub, seed=seed + j)
+                                  for j in range(self.m)])
+
+            self._centroids = centroids
+            self._codebooks = codebooks
+            np.savez(self._quantizer_file, centroids=centroids, codebooks=codebooks)
+            self._open_codes(len(self._vectors))
+            self._encode_positions(np.arange(self._size))
+
+    def _added(self, positions, matrix: np.ndarray) -> None:
+        if self.trained:
+            self._encode_positions(np.fromiter(positions, dtype=np.int64))
+        elif self.auto_train and self._size >= self.nlist * MIN_POINTS_PER_CENTROID:
+            self.train()
+
+    def _inverted_lists(self) -> List[np.ndarray]:
+        # rebuilt after inserts, a replaced document may have moved to another list
+        if self._lists is None:
+            assign = np.asarray(self._assign[:self._size])
+            order = np.argsort(assign, kind='stable')
+            self._lists = np.split(order, np.cumsum(np.bincount(assign, minlength=len(self._centroids)))[:-1])
+        return self._lists
+
+    def _search_vectors(self, queries: np.ndarray, top_k: int) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        if not self.trained:
+            return super()._search_vectors(queries, top_k)
+
+        lists = self._inverted_lists()
+        nprobe = min(self.nprobe, len(self._centroids))
+        coarse = queries @ self._centroids.T
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        # q.(c + r) = q.c + sum_j q_j.codebook_j[code_j], one lookup table per query serves every list
+        sub = self.dim // self.m
+        tables = np.einsum('qjd,jkd->qjk', queries.reshape(len(queries), self.m, sub), self._codebooks)
+        subspaces = np.arange(self.m)
+
+        all_positions, all_scores = [], []
+        for q, query in enumerate(queries):
+            candidates = np.concatenate([lists[l] for l in probes[q]])
+            if len(candidates) == 0:
+                all_positions.append(np.empty(0, dtype=np.int64))
+                all_scores.append(np.empty(0, dtype=np.float32))
+                continue
+
+            approx = coarse[q, self._assign[candidates]] + tables[q][subspaces, self._codes[candidates]].sum(axis=1)
+            shortlist = max(top_k * self.rerank_factor, top_k)
+            if len(candidates) > shortlist:
+                candidates = candidates[np.argpartition(-approx, shortlist - 1)[:shortlist]]
+
+            # exact re-rank, the only reads of full vectors (sorted for sequential memmap access)
+            candidates = np.sort(candidates)
+            exact = np.asarray(self._vectors[candidates]) @ query
+            best = np.argsort(-exact, kind='stable')[:top_k]
+            all_positions.append(candidates[best])
+            all_scores.append(exact[best])
+
+        return all_positions, all_scores
+
+    def memory_bytes(self) -> int:
+        '''
+        Resident size of the search structures: codes, list entries and quantizers (full vectors stay on disk)
+        '''
+        if not self.trained:
+            return self._size * self.dim * 4
+        return self._size * (self.m + 4 + 8) + self._centroids.nbytes + self._codebooks.nbytes
+
+    def delete_all(self) -> None:
+        with self._lock:
+            super().delete_all()
+            self._open_codes(0)
+            self._centroids = None
+            self._codebooks = None
+            self._lists = None
+            for path in (self._quantizer_file, self._lists_file, self._codes_file):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def close(self) -> None:
+        with self._lock:
+            self._open_codes(0)
+            super().close()
@@ -0,0 +1,166 @@
+from typing import Dict, List, Tuple, Union
+from multiprocessing.connection import Listener
+import multiprocessing as mp
+import threading
+import time
+from .cluster import LogosCluster
+from .rpc import DEFAULT_AUTHKEY, INSECURE_AUTHKEY, Address, RemoteNode, format_address, is_loopback, parse_address
+
+'''
+This file contains the NodeServer class, which serves a set of local node files to remote LogosClusters.
+
+A LogosCluster with a placement map (node -> address, see LogosCluster.set_placement) sends the reads and
+writes of remote nodes to their server instead of opening the files itself. Every RPC is batched:
+one round trip per query_by_ids group, query_chunk page or insert_batch.
+
+Example, two servers on localhost:
+spawn_node_server('cluster_a', ['Physics'], 'localhost:7001')
+spawn_node_server('cluster_b', ['Biology'], 'localhost:7002')
+cluster = LogosCluster(placement={'Physics': 'localhost:7001', 'Biology': 'localhost:7002'})
+'''
+
+STARTUP_TIMEOUT = 10  # seconds spawn_node_server waits for a new server to answer
+
+
+class NodeServer:
+    '''
+    Serve the nodes of a local LogosCluster over multiprocessing.connection, one thread per client connection
+    '''
+
+    def __init__(self, data_dir: str, nodes: List[str], address: Union[str, Tuple[str, int]], authkey: bytes = DEFAULT_AUTHKEY, **cluster_kwargs) -> None:
+        self.address = parse_address(address)
+        if not authkey:
+            raise ValueError('NodeServer: an authkey is required, requests are unpickled once it is verified')
+        if authkey == INSECURE_AUTHKEY and not is_loopback(self.address):
+            raise ValueError(f'NodeServer: refusing to serve {format_address(self.address)} with the built-in authkey, '
+                             'set LOGOS_AUTHKEY on the server and its clients')
+        self.authkey = authkey
+
+        self.cluster = LogosCluster(data_dir=data_dir, **cluster_kwargs)
+        self.cluster.nodes = list(nodes)
+
+        self._listener = None
+        self._stopped = threading.Event()
+
+        # RPC name -> handler, nothing else is callable remotely
+        self._methods = {
+            'ping': lambda: True,
+            'nodes': lambda: self.cluster.nodes,
+            'build_cluster': self.build_cluster,
+            'query': self.cluster.query,
+            'query_by_ids': self.query_by_ids,
+            'select_page': self.cluster._select_page,
+            'id_bounds': self.cluster._id_bounds,
+            'select_since': self.cluster._select_since,
+            'latest_change': self.cluster.latest_change,
+            'insert_rows': self.insert_rows,
+            'done_units': self.cluster.done_units,
+            'ingest_sources': self.cluster.ingest_sources,
+            'search_node': self.cluster._search_node,
+            'stats': self.stats,
+        }
+
+    def build_cluster(self, nodes: List[str]) -> bool:
+        self.cluster.nodes = list(dict.fromkeys(self.cluster.nodes + list(nodes)))
+        return self.cluster.build_cluster() is not False
+
+    def query_by_ids(self, row_ids: List[int], node: str) -> List[Tuple]:
+        # errors travel back to the client instead of becoming an empty result
+        return list(self.cluster.iter_by_ids(row_ids, node))
+
+    def insert_rows(self, data: List[Tuple[str, str]], node: str, upsert: bool = False,
+                    source: Union[str, None] = None, units: List[Tuple[int, int]] = ()) -> int:
+        '''
+        Write and commit one batch together with the input units it completes, return the number of duplicates skipped
+        '''
+        with self.cluster._write_transaction(node):
+            try:
+                skipped = self.cluster._append_rows(data, node, upsert, source, units)
+                self.cluster._commit(node)
+                return skipped
+            except Exception:
+                self.cluster._rollback(node)
+                raise
+
+    def stats(self) -> Dict[str, Dict]:
+        served = set(self.cluster.nodes)
+        return {node: stats for node, stats in self.cluster.stats().items() if node in served}
+
+    def _check_node(self, method: str, args: tuple) -> None:
+        # every node argument is positional, see LogosCluster's remote calls
+        node = {'query': 1, 'query_by_ids': 1, 'select_page': 0, 'id_bounds': 0, 'select_since': 0, 'latest_change': 0,
+                'insert_rows': 1, 'done_units': 1, 'ingest_sources': 0, 'search_node': 1}.get(method)
+        if node is not None and args[node] not in self.cluster.nodes:
+            raise KeyError(f'node {args[node]} is not served here')
+
+    def _serve_connection(self, conn) -> None:
+        try:
+            while not self._stopped.is_set():
+                try:
+                    method, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    handler = self._methods.get(method)
+                    if handler is None:
+                        raise ValueError(f'unknown method {method}')
+                    self._check_node(method, args)
+                    reply = (True, handler(*args))
+                except Exception as e:
+                    reply = (False, f'{type(e).__name__}: {e}')
+                conn.send(reply)
+        finally:
+            conn.close()
+            # the thread ends with its client, its node connections would stay open until shutdown
+            self.cluster.release_thread()
+
+    def serve_forever(self) -> None:
+        self._listener = Listener(self.address, authkey=self.authkey)
+        print(f'NodeServer: serving {len(self.cluster.nodes)} nodes on {format_address(self.address)}')
+        try:
+            while not self._stopped.is_set():
+                try:
+                    conn = self._listener.accept()
+                except mp.AuthenticationError as e:
+                    print(f'NodeServer: rejected a client: {e}')
+                    continue
+                except OSError:
+                    break  # listener closed by shutdown
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            self.cluster.close()
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        if self._listener is not None:
+            self._listener.close()
+
+
+def run_node_server(data_dir: str, nodes: List[str], address: Address, authkey: bytes = DEFAULT_AUTHKEY, **cluster_kwargs) -> None:
+    NodeServer(data_dir, nodes, address, authkey, **cluster_kwargs).serve_forever()
+
+
+def spawn_node_server(data_dir: str, nodes: List[str], address: Union[str, Tuple[str, int]], authkey: bytes = DEFAULT_AUTHKEY, **cluster_kwargs) -> mp.Process:
+    '''
+    Start a node server in a daemon process and wait until it answers, e.g. several on localhost for testing;
+    terminate() stops it
+    '''
+    process = mp.Process(target=run_node_server, args=(data_dir, nodes, parse_address(address), authkey),
+                         kwargs=cluster_kwargs, daemon=True)
+    process.start()
+
+    client = RemoteNode(address, authkey)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    try:
+        while True:
+            try:
+                client.call('ping')
+                return process
+            except OSError:
+                if not process.is_alive() or time.monotonic() > deadline:
+                    process.terminate()
+                    raise RuntimeError(f'NodeServer: server on {format_address(client.address)} did not start')
+                time.sleep(0.05)
+    finally:
+        client.close()
@@ -0,0 +1,73 @@
+from typing import Dict, Hashable, List, Union
+from collections import OrderedDict
+import threading
+import time
+
+'''
+This file contains the QueryCache class, a bounded LRU + TTL cache of SumDB search results.
+'''
+
+DEFAULT_QUERY_CACHE_SIZE = 1024  # cached searches
+DEFAULT_QUERY_CACHE_TTL = 300  # seconds, bounds staleness from writes the cache cannot see (e.g. other processes)
+
+
+def normalize_query(query: str) -> str:
+    # e5 is uncased and ignores runs of whitespace, so these spellings search the same
+    return ' '.join(query.casefold().split())
+
+
+class QueryCache:
+    '''
+    LRU cache of search key -> hits, entries expire after ttl seconds or once the index version moves on
+
+    Counters: hits, misses (never cached or evicted) and stale (cached but expired or older than the index).
+    '''
+
+    def __init__(self, max_entries: int = DEFAULT_QUERY_CACHE_SIZE, ttl: float = DEFAULT_QUERY_CACHE_TTL) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, key: Hashable, version: int) -> Union[List[Dict], None]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            entry_version, expires_at, results = entry
+            if entry_version != version or time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.stale += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # callers may modify their hits, the cached ones stay untouched
+        return [dict(hit) for hit in results]
+
+    def put(self, key: Hashable, version: int, results: List[Dict]) -> None:
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, [dict(hit) for hit in results])
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'entries': len(self._entries),
+            }
@@ -0,0 +1,96 @@
+from typing import Dict, Set, Tuple, Union
+from collections import OrderedDict
+import threading
+
+'''
+This file contains the RowCache class, a bounded in-process LRU cache of decoded LogosCluster rows.
+'''
+
+ROW_OVERHEAD_BYTES = 100  # rough cost of the tuple, key and bookkeeping per cached row
+
+
+class RowCache:
+    '''
+    LRU cache of (node, ID) -> row, bounded by number of rows and by approximate bytes
+
+    Counters: hits, misses, evictions (LRU drops) and invalidations (rows dropped by a write to their node).
+    '''
+
+    def __init__(self, max_rows: int, max_bytes: int) -> None:
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+
+        self._rows: 'OrderedDict[Tuple[str, int], tuple]' = OrderedDict()
+        self._node_keys: Dict[str, Set[int]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __getstate__(self) -> dict:
+        # a cache never travels to another process, the copy starts empty
+        return {'max_rows': self.max_rows, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['max_rows'], state['max_bytes'])
+
+    @staticmethod
+    def _size(row: tuple) -> int:
+        content = row[1]
+        return ROW_OVERHEAD_BYTES + (len(content) if isinstance(content, (str, bytes)) else 0)
+
+    def get(self, node: str, _id: int) -> Union[tuple, None]:
+        with self._lock:
+            row = self._rows.get((node, _id))
+            if row is None:
+                self.misses += 1
+                return None
+            self._rows.move_to_end((node, _id))
+            self.hits += 1
+            return row
+
+    def put(self, node: str, row: tuple) -> None:
+        size = self._size(row)
+        if size > self.max_bytes:
+            return
+
+        key = (node, row[0])
+        with self._lock:
+            old = self._rows.pop(key, None)
+            if old is not None:
+                self._bytes -= self._size(old)
+
+            self._rows[key] = row
+            self._node_keys.setdefault(node, set()).add(row[0])
+            self._bytes += size
+
+            while len(self._rows) > self.max_rows or self._bytes > self.max_bytes:
+                (old_node, old_id), old = self._rows.popitem(last=False)
+                self._node_keys[old_node].discard(old_id)
+                self._bytes -= self._size(old)
+                self.evictions += 1
+
+    def invalidate(self, node: str) -> None:
+        '''
+        Drop every cached row of a node
+        '''
+        with self._lock:
+            for _id in self._node_keys.pop(node, ()):
+                row = self._rows.pop((node, _id), None)
+                if row is not None:
+                    self._bytes -= self._size(row)
+                    self.invalidations += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'rows': len(self._rows),
+                'bytes': self._bytes,
+            }
@@ -0,0 +1,119 @@
+from typing import Tuple, Union
+from multiprocessing.connection import Client
+import ipaddress
+import os
+import socket
+import threading
+
+'''
+This file contains the client side of the LogosCluster node protocol, see node_server.py for the server.
+
+Messages are pickled (method, args) requests answered by (ok, value) replies over multiprocessing.connection,
+which authenticates both ends with an HMAC challenge on the shared authkey before anything is unpickled.
+Only run node servers on networks you trust with that key.
+'''
+
+# built-in key, public in this repository: node servers accept it on loopback addresses only
+INSECURE_AUTHKEY = b'logos-cluster'
+
+# shared secret of clients and node servers, set the LOGOS_AUTHKEY environment variable for any other address
+DEFAULT_AUTHKEY = os.environ.get('LOGOS_AUTHKEY', '').encode('utf-8') or INSECURE_AUTHKEY
+
+Address = Union[Tuple[str, int], str]
+
+# RPCs without side effects, the only ones resent when the connection drops after the request went out
+READ_ONLY_METHODS = frozenset({'ping', 'nodes', 'query', 'query_by_ids', 'select_page', 'id_bounds', 'select_since', 'latest_change',
+                               'done_units', 'ingest_sources', 'search_node', 'stats'})
+
+
+def parse_address(address: Union[str, Tuple[str, int]]) -> Address:
+    '''
+    'host:port' -> (host, port), a filesystem path is kept as a Unix socket address
+    '''
+    if isinstance(address, (tuple, list)):
+        return (address[0], int(address[1]))
+    if ':' in address and not address.startswith('/'):
+        host, port = address.rsplit(':', 1)
+        return (host, int(port))
+    return address
+
+
+def format_address(address: Address) -> str:
+    return f'{address[0]}:{address[1]}' if isinstance(address, tuple) else address
+
+
+def is_loopback(address: Address) -> bool:
+    '''
+    True if only this machine can reach the address: a Unix socket, or a host resolving to loopback IPs only
+    '''
+    if not isinstance(address, tuple):
+        return True
+    host = address[0]
+    if not host:
+        return False  # '' listens on every interface
+    try:
+        ips = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except OSError:
+        return False
+    return bool(ips) and all(ipaddress.ip_address(ip.split('%')[0]).is_loopback for ip in ips)
+
+
+class RemoteNode:
+    '''
+    Client of one node server, each thread keeps its own connection to it
+    '''
+
+    def __init__(self, address: Union[str, Tuple[str, int]], authkey: bytes = DEFAULT_AUTHKEY) -> None:
+        self.address = parse_address(address)
+        self.authkey = authkey
+
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = Client(self.address, authkey=self.authkey)
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def _drop_connection(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            with self._lock:
+                if conn in self._conns:
+                    self._conns.remove(conn)
+            conn.close()
+
+    def call(self, method: str, *args):
+        '''
+        Run one RPC on the server and return its result, server-side errors are raised as RuntimeError
+        '''
+        # a connection the server dropped (e.g. after a restart) is replaced once; a write whose request
+        # was already sent is not resent, the server may have applied it before the connection broke
+        for attempt in range(2):
+            sent = False
+            try:
+                conn = self._connection()
+                conn.send((method, args))
+                sent = True
+                ok, value = conn.recv()
+                break
+            except (EOFError, ConnectionError, OSError):
+                self._drop_connection()
+                if attempt or (sent and method not in READ_ONLY_METHODS):
+                    raise
+
+        if not ok:
+            raise RuntimeError(f'RemoteNode {format_address(self.address)}: {value}')
+        return value
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns = []
+        self._local = threading.local()
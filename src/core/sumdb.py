@@ -1,29 +1,37 @@
-from typing import List, Dict
+from typing import List, Dict, Union
 from src.summarization import mass_qlora_abstract_sum, mass_abstract_sum, mass_extract_summaries
 from src.core import LogosCluster
-import marqo
+from .sumdb_backends import SumDBBackend, MarqoBackend
+from .query_cache import QueryCache, normalize_query, DEFAULT_QUERY_CACHE_SIZE, DEFAULT_QUERY_CACHE_TTL
 
 '''
 This file contains the SumDB class, which is responsible for storing summarized vectors and querying similar content.
+
+Vectors are stored and searched by a backend (see sumdb_backends.py): a Marqo index by default,
+or e.g. SumDB(backend=LocalBackend('sumdb_local')) to run without a Marqo server.
+
+Search results are cached (LRU + TTL) and invalidated by the index version every insert and delete_all bumps.
 '''
 
 
 class SumDB:
-    def __init__(self, host: str = 'localhost', port: int = 8882, index_name: str = 'sumdb') -> None:
+    def __init__(self, host: str = 'localhost', port: int = 8882, index_name: str = 'sumdb', backend: Union[SumDBBackend, None] = None,
+                 query_cache_size: int = DEFAULT_QUERY_CACHE_SIZE, query_cache_ttl: float = DEFAULT_QUERY_CACHE_TTL) -> None:
         self.host = host
         self.port = port
-
-        # set up Marqo connector
-        self.db = marqo.Client(url=f'http://{self.host}:{self.port}')
+        self.index_name = index_name
 
         # Only create index if it does not exist
         # index_name = 'one_node_sumdb' # use for one_node sumdb
         # index_name = 'sumdb'
-        try:
-            self.db.create_index(index_name, model="hf/e5-base-v2")
-        except:
-            pass
-        self.index = self.db.index(index_name)
+        self.backend = backend or MarqoBackend(host, port, index_name)
+
+        # name of this index's high-water marks in the cluster catalog, used by incremental summarization
+        self.consumer_name = f'sumdb@{self.backend.name}'
+
+        # bumped by every write, cached results of an older version are stale; query_cache_size=0 disables the cache
+        self.index_version = 0
+        self.query_cache = QueryCache(query_cache_size, query_cache_ttl) if query_cache_size > 0 else None
 
     def insert(self, vectors: List[Dict[str, str]], CHUNK_SIZE: int = 128) -> bool:
         '''
@@ -34,6 +42,7 @@ class SumDB:
         Vector data structure:
         {
             'row_id': 'unique_id',
+            'doc_id': global_doc_id,  # optional, LogosCluster.doc_id(topic, row_id)
             'summary': 'content_text',
             'topic': 'topic_name',
         }
@@ -41,37 +50,86 @@ class SumDB:
         try:
             for i in range(0, len(vectors), CHUNK_SIZE):
                 batch = vectors[i:i + CHUNK_SIZE]
-                self.index.add_documents(batch, tensor_fields=['summary'])
+                self.backend.add_documents(batch)
+                self.index_version += 1
 
             return True
 
         except Exception as e:
+            # a failed batch may still have been partly written
+            self.index_version += 1
             print(f'Error at SumDB insert: {e}')
             return False
 
-    def query(self, query_vector: str, top_k: int = 5) -> List[Dict[str, str]]:
+    def query(self, query_vector: str, top_k: int = 5, filters: Union[Dict[str, str], None] = None) -> List[Dict[str, str]]:
         '''
         Query similar content from SumDB, only output top results with highest similarity score
+
+        filters keeps hits whose fields equal the given values, e.g. {'topic': 'Physics'}
         '''
         try:
-            return self.index.search(
-                q=query_vector,
-                limit=top_k
-            )['hits']
+            key = self._cache_key(query_vector, top_k, filters)
+            # read before searching, results of a search overlapping a write are cached as already stale
+            version = self.index_version
+            if self.query_cache is not None:
+                cached = self.query_cache.get(key, version)
+                if cached is not None:
+                    return cached
+
+            results = self.backend.search(query_vector, top_k, filters)
+            if self.query_cache is not None:
+                self.query_cache.put(key, version, results)
+            return results
 
         except Exception as e:
             print(f'Error at SumDB query: {e}')
             return []
 
+    def query_many(self, query_vectors: List[str], top_k: int = 5, filters: Union[Dict[str, str], None] = None) -> List[List[Dict[str, str]]]:
+        '''
+        Query several questions at once, return the top results of each in the order of query_vectors
+
+        Cached questions are answered from the query cache, the others are searched by the backend in one batch
+        (one embedding batch and one matrix product with LocalBackend)
+        '''
+        try:
+            keys = [self._cache_key(query_vector, top_k, filters) for query_vector in query_vectors]
+            version = self.index_version
+            results = [None] * len(query_vectors)
+            if self.query_cache is not None:
+                results = [self.query_cache.get(key, version) for key in keys]
+
+            # a question repeated within the batch is searched once
+            first = {}
+            for i, cached in enumerate(results):
+                if cached is None:
+                    first.setdefault(keys[i], i)
+            if first:
+                found = self.backend.search_many([query_vectors[i] for i in first.values()], top_k, filters)
+                by_key = dict(zip(first, found))
+                if self.query_cache is not None:
+                    for key, hits in by_key.items():
+                        self.query_cache.put(key, version, hits)
+                for i, key in enumerate(keys):
+                    if results[i] is None:
+                        results[i] = by_key[key] if first[key] == i else [dict(hit) for hit in by_key[key]]
+
+            return results
+
+        except Exception as e:
+            print(f'Error at SumDB query_many: {e}')
+            return [[] for _ in query_vectors]
+
+    @staticmethod
+    def _cache_key(query_vector: str, top_k: int, filters: Union[Dict[str, str], None]) -> tuple:
+        return (normalize_query(query_vector), top_k, tuple(sorted((field, str(value)) for field, value in (filters or {}).items())))
+
     def query_all(self, top_k: int = 5) -> List[Dict[str, str]]:
         '''
         Query all content from SumDB, only output top results with highest similarity score
         '''
         try:
-            return self.index.search(
-                q='*',
-                limit=top_k
-            )['hits']
+            return self.backend.documents(top_k)
 
         except Exception as e:
             print(f'Error at SumDB query_all: {e}')
@@ -82,32 +140,29 @@ class SumDB:
         Delete all vectors from SumDB by actual ID, not row_id
         '''
         try:
-            all_docs = self.index.search(
-                q='', limit=128)  # Adjust limit as needed
-            while len(all_docs['hits']) > 0:
-                id_set = []
-                for hit in all_docs['hits']:
-                    id_set.append(hit['_id'])
-
-                self.index.delete_documents(id_set)
-
-                all_docs = self.index.search(q='', limit=128)
-
+            self.backend.delete_all()
+            self.index_version += 1
             return True
 
         except Exception as e:
+            self.index_version += 1
             print(f'Error at SumDB delete_all: {e}')
             return False
 
     # TODO: Uncomment when built mass_extract_summaries with Cython
-    def summarize_node(self, node: str, cluster: LogosCluster, CHUNK_SIZE: int = 128) -> bool:
+    def summarize_node(self, node: str, cluster: LogosCluster, CHUNK_SIZE: int = 128, after_id: int = 0, until_id: Union[int, None] = None, incremental: bool = False) -> bool:
         '''
         Summarize content from a single node in the cluster
+
+        Only rows with after_id < ID <= until_id are summarized, pass the last logged ID as after_id to resume
+        With incremental, only rows changed since this index's high-water mark are summarized, and the mark
+        advances after every chunk
         '''
         try:
             # Divide data into chunks to avoid memory overload
             count = 0
-            for chunk in cluster.query_chunk(node, CHUNK_SIZE):
+            chunks = self._node_chunks(node, cluster, CHUNK_SIZE, after_id, until_id, incremental)
+            for chunk in chunks:
                 insert_data = []
                 print(f'[INFO] Summarizing chunk {count}...')
                 # Each chunk is a list of rows (ID: int, Content: str, UpdatedAt: datetime)
@@ -117,12 +172,15 @@ class SumDB:
                 # Then modified the chunk with summarized content
                 for summary, row in zip(summaries, chunk):
                     insert_data.append(
-                        {'row_id': row[0], 'summary': summary, 'topic': node})
+                        {'_id': f'{node}-{row[0]}', 'row_id': row[0], 'doc_id': cluster.doc_id(node, row[0]), 'summary': summary, 'topic': node})
 
                 # Finally insert summarized data into SumDB
-                self.insert(insert_data, CHUNK_SIZE)
+                if not self.insert(insert_data, CHUNK_SIZE):
+                    return False
+                if incremental:
+                    cluster.set_watermark(node, *chunks.last_key, consumer=self.consumer_name)
 
-                print(f'[INFO] Finished summarizing chunk {count}')
+                print(f'[INFO] Finished summarizing chunk {count} (last ID: {chunk[-1][0]})')
                 count += 1
 
             return True
@@ -131,14 +189,19 @@ class SumDB:
             print(f'Error at SumDB summarize_node: {e}')
             return False
 
-    def summarize_node_abstract(self, node: str, cluster: LogosCluster, CHUNK_SIZE: int = 128) -> bool:
+    def summarize_node_abstract(self, node: str, cluster: LogosCluster, CHUNK_SIZE: int = 128, after_id: int = 0, until_id: Union[int, None] = None, incremental: bool = False) -> bool:
         '''
         Summarize content from a single node in the cluster
+
+        Only rows with after_id < ID <= until_id are summarized, pass the last logged ID as after_id to resume
+        With incremental, only rows changed since this index's high-water mark are summarized, and the mark
+        advances after every chunk
         '''
         try:
             # Divide data into chunks to avoid memory overload
             count = 0
-            for chunk in cluster.query_chunk(node, CHUNK_SIZE):
+            chunks = self._node_chunks(node, cluster, CHUNK_SIZE, after_id, until_id, incremental)
+            for chunk in chunks:
                 insert_data = []
                 print(f'[INFO] Summarizing chunk {count}...')
                 # Each chunk is a list of rows (ID: int, Content: str, UpdatedAt: datetime)
@@ -154,12 +217,15 @@ class SumDB:
                 # Then modified the chunk with summarized content
                 for summary, row in zip(summaries, chunk):
                     insert_data.append(
-                        {'row_id': row[0], 'summary': summary, 'topic': node})
+                        {'_id': f'{node}-{row[0]}', 'row_id': row[0], 'doc_id': cluster.doc_id(node, row[0]), 'summary': summary, 'topic': node})
 
                 # Finally insert summarized data into SumDB
-                self.insert(insert_data, CHUNK_SIZE)
+                if not self.insert(insert_data, CHUNK_SIZE):
+                    return False
+                if incremental:
+                    cluster.set_watermark(node, *chunks.last_key, consumer=self.consumer_name)
 
-                print(f'[INFO] Finished summarizing chunk {count}')
+                print(f'[INFO] Finished summarizing chunk {count} (last ID: {chunk[-1][0]})')
                 count += 1
 
             return True
@@ -168,55 +234,62 @@ class SumDB:
             print(f'Error at SumDB summarize_node: {e}')
             return False
 
+    def _node_chunks(self, node: str, cluster: LogosCluster, CHUNK_SIZE: int, after_id: int, until_id: Union[int, None], incremental: bool):
+        if not incremental:
+            return cluster.query_chunk(node, CHUNK_SIZE, after_id, until_id)
+
+        # a node never summarized into this index starts from the beginning
+        mark = cluster.get_watermark(node, self.consumer_name) or ('', 0)
+        print(f'[INFO] Summarizing rows of node {node} changed after {mark[0] or "the beginning"}')
+        return cluster.query_since(node, mark[0], CHUNK_SIZE, mark[1])
+
     def count_vectors(self) -> int:
         '''
         This function returns the total number of vectors in SumDB
         '''
         try:
-            count = 0
-            all_docs = self.index.search(
-                q='', limit=1000)  # Adjust limit as needed
-            while len(all_docs['hits']) > 0:
-                id_set = []
-                for hit in all_docs['hits']:
-                    id_set.append(hit['_id'])
-                print(f'Counting {len(id_set)} documents')
-
-                count += 1000
-                all_docs = self.index.search(q='', limit=1000)
-
-                #! Count only the first 1k rows for now
-                break
-            return count
+            return self.backend.count()
 
         except Exception as e:
             print(f'Error at SumDB count_vectors: {e}')
             return -1
 
-        return count
-
-    def summarize_cluster(self, cluster: LogosCluster, CHUNK_SIZE: int = 128, abstract_mode: bool = False) -> bool:
+    def summarize_cluster(self, cluster: LogosCluster, CHUNK_SIZE: int = 128, abstract_mode: bool = False, incremental: bool = False) -> bool:
         '''
         Summarize all content from the cluster to SumDB 
         Abstract mode for abstract summarization
         If set to False, it will use extractive summarization
+
+        Incremental mode only summarizes rows added or changed since the previous run,
+        a full run records the point it covered so the next incremental run starts there
         '''
         try:
             # Query data from each node and summarize
             for node in cluster.nodes:
                 print(f'[INFO] Processing node {node}')
+                # rows changing during a full run are picked up again by the next incremental run
+                latest = None if incremental else cluster.latest_change(node)
                 if abstract_mode:
                     insert_status = self.summarize_node_abstract(
-                        node, cluster, CHUNK_SIZE)
+                        node, cluster, CHUNK_SIZE, incremental=incremental)
                 else:
                     insert_status = self.summarize_node(
-                        node, cluster, CHUNK_SIZE)
+                        node, cluster, CHUNK_SIZE, incremental=incremental)
 
                 if not insert_status:
                     return False
 
+                if latest is not None:
+                    cluster.set_watermark(node, *latest, consumer=self.consumer_name)
+
                 print(f'[INFO] Node {node} summarized successfully')
 
+            cache = getattr(self.backend, 'embedding_cache', None)
+            if cache is not None:
+                stats = cache.stats()
+                print(f'[INFO] Embedding cache: {stats["hit_rate"]:.1%} hit rate ({stats["hits"]} hits, {stats["misses"]} misses, '
+                      f'{stats["evictions"]} evictions, {stats["entries"]} entries)')
+
             return True
 
         except Exception as e:
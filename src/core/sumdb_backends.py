@@ -0,0 +1,375 @@
+from typing import Dict, List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import sqlite3
+import threading
+import uuid
+import numpy as np
+from .embedding import E5Embedder, normalize
+from .embedding_cache import CachedEmbedder, EmbeddingCache, DEFAULT_CACHE_BYTES
+
+try:
+    import marqo
+except ImportError:
+    marqo = None
+
+'''
+This file contains the storage backends behind SumDB: where summary vectors live and how they are searched.
+
+MarqoBackend keeps the original Marqo index (embedding and search on the Marqo server).
+LocalBackend runs in-process: unit float32 embeddings in a memory-mapped matrix, a SQLite sidecar
+for _id/row_id/topic/summary and other fields, and exact top-k by matrix product. Texts are embedded
+through a persistent embedding cache, so re-indexing unchanged summaries costs no model calls.
+
+Every backend returns Marqo-shaped hits: the stored document fields plus '_id' and '_score'.
+'''
+
+TENSOR_FIELD = 'summary'  # the embedded field of every document
+MARQO_MODEL = 'hf/e5-base-v2'
+MARQO_PAGE_SIZE = 128  # documents per delete_all search page
+MARQO_SEARCH_THREADS = 8  # concurrent searches of search_many without a bulk search endpoint
+
+VECTORS_FILE = 'vectors.f32'
+DOCS_FILE = 'docs.db'
+CACHE_DIR = 'embedding_cache'  # inside the index directory unless cache_dir is given
+INITIAL_CAPACITY = 1024  # rows of the first vector file, it doubles when full
+SEARCH_BLOCK_ROWS = 65536  # vectors scored per matrix product, bounds memory on large indexes
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, top_k: int, block_rows: int = SEARCH_BLOCK_ROWS,
+                rows: Union[np.ndarray, None] = None) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Exact inner-product top-k of every query against the rows of vectors (or only rows, ascending), return (positions, scores)
+
+    Both are (len(queries), min(top_k, number of rows)) and sorted by descending score. vectors is read
+    block by block, so a memory-mapped matrix larger than RAM is streamed once per call.
+    '''
+    rows = np.arange(len(vectors)) if rows is None else rows
+    k = min(top_k, len(rows))
+    best_pos = np.empty((len(queries), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    if k <= 0:
+        return best_pos, best_scores
+
+    for start in range(0, len(rows), block_rows):
+        chunk = rows[start:start + block_rows]
+        if chunk[-1] - chunk[0] == len(chunk) - 1:
+            block = np.asarray(vectors[chunk[0]:chunk[-1] + 1])  # contiguous rows, a plain slice of the mapping
+        else:
+            block = np.asarray(vectors[chunk])
+        scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+        pos = np.concatenate([best_pos, np.broadcast_to(chunk, (len(queries), len(chunk)))], axis=1)
+        if scores.shape[1] > k:
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, keep, axis=1)
+            pos = np.take_along_axis(pos, keep, axis=1)
+        best_pos, best_scores = pos, scores
+
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    return np.take_along_axis(best_pos, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class SumDBBackend:
+    '''
+    Interface of a SumDB backend, methods raise on failure and SumDB reports the error
+
+    name identifies the index, e.g. in the consumer name of incremental summarization
+    '''
+    name = 'sumdb'
+
+    def add_documents(self, documents: List[Dict]) -> None:
+        '''
+        Add or replace (same _id) documents, TENSOR_FIELD is embedded
+        '''
+        raise NotImplementedError
+
+    def search(self, query: str, top_k: int, filters: Union[Dict, None] = None) -> List[Dict]:
+        '''
+        Top hits for a query, filters keeps documents whose fields equal the given values
+        '''
+        raise NotImplementedError
+
+    def search_many(self, queries: List[str], top_k: int, filters: Union[Dict, None] = None) -> List[List[Dict]]:
+        '''
+        Top hits of every query, in the order of queries
+        '''
+        return [self.search(query, top_k, filters) for query in queries]
+
+    def documents(self, limit: int) -> List[Dict]:
+        '''
+        Up to limit stored documents as hits, in no particular ranking
+        '''
+        raise NotImplementedError
+
+    def delete_all(self) -> None:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MarqoBackend(SumDBBackend):
+    '''
+    A Marqo index, created with MARQO_MODEL if it does not exist yet
+    '''
+
+    def __init__(self, host: str = 'localhost', port: int = 8882, index_name: str = 'sumdb') -> None:
+        if marqo is None:
+            raise ImportError('MarqoBackend: needs the marqo client, pip install marqo, or use LocalBackend')
+
+        self.name = f'{host}:{port}/{index_name}'
+        self.index_name = index_name
+        self.db = marqo.Client(url=f'http://{host}:{port}')
+
+        # Only create index if it does not exist
+        try:
+            self.db.create_index(index_name, model=MARQO_MODEL)
+        except:
+            pass
+        self.index = self.db.index(index_name)
+
+    def add_documents(self, documents: List[Dict]) -> None:
+        self.index.add_documents(documents, tensor_fields=[TENSOR_FIELD])
+
+    def search(self, query: str, top_k: int, filters: Union[Dict, None] = None) -> List[Dict]:
+        if not filters:
+            return self.index.search(q=query, limit=top_k)['hits']
+        return self.index.search(q=query, limit=top_k, filter_string=self.filter_string(filters))['hits']
+
+    def search_many(self, queries: List[str], top_k: int, filters: Union[Dict, None] = None) -> List[List[Dict]]:
+        # clients before marqo 3 have one bulk search request, newer servers embed concurrent searches together
+        if hasattr(self.db, 'bulk_search'):
+            requests = [{'index': self.index_name, 'q': query, 'limit': top_k} for query in queries]
+            if filters:
+                for request in requests:
+                    request['filter'] = self.filter_string(filters)
+            return [result['hits'] for result in self.db.bulk_search(requests)['result']]
+
+        with ThreadPoolExecutor(max_workers=min(MARQO_SEARCH_THREADS, max(1, len(queries)))) as pool:
+            return list(pool.map(lambda query: self.search(query, top_k, filters), queries))
+
+    @staticmethod
+    def filter_string(filters: Dict) -> str:
+        # Marqo filter DSL, backslashes and parentheses in values are escaped
+        escaped = {field: str(value).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') for field, value in filters.items()}
+        return ' AND '.join(f'{field}:({value})' for field, value in escaped.items())
+
+    def documents(self, limit: int) -> List[Dict]:
+        return self.index.search(q='*', limit=limit)['hits']
+
+    def delete_all(self) -> None:
+        # delete by actual ID, not row_id
+        all_docs = self.index.search(q='', limit=MARQO_PAGE_SIZE)
+        while len(all_docs['hits']) > 0:
+            self.index.delete_documents([hit['_id'] for hit in all_docs['hits']])
+            all_docs = self.index.search(q='', limit=MARQO_PAGE_SIZE)
+
+    def count(self) -> int:
+        count = 0
+        all_docs = self.index.search(q='', limit=1000)
+        if len(all_docs['hits']) > 0:
+            print(f'Counting {len(all_docs["hits"])} documents')
+            #! Count only the first 1k rows for now
+            count += 1000
+        return count
+
+
+class LocalBackend(SumDBBackend):
+    '''
+    In-process index in a directory: VECTORS_FILE holds one unit float32 row per document, DOCS_FILE maps rows to documents
+
+    The embedding cache survives delete_all, pass the same cache_dir to share it between indexes
+    of one process (e.g. SumDB and paraDB), or cache_bytes=0 to disable it.
+
+    Example usage:
+    sumdb = SumDB(backend=LocalBackend('sumdb_local'))
+    '''
+
+    def __init__(self, path: str = 'sumdb_local', embedder=None, cache_dir: str = None, cache_bytes: int = DEFAULT_CACHE_BYTES) -> None:
+        self.path = path
+        self.name = f'local:{os.path.abspath(path)}'
+        # anything with dim and embed(texts, kind) -> (len(texts), dim) array, see E5Embedder;
+        # add_vectors/search_vectors only use dim
+        embedder = embedder or E5Embedder()
+        self.dim = embedder.dim
+        os.makedirs(path, exist_ok=True)
+
+        self.embedding_cache = None
+        if cache_bytes > 0:
+            self.embedding_cache = EmbeddingCache(cache_dir or os.path.join(path, CACHE_DIR), self.dim, cache_bytes)
+            embedder = CachedEmbedder(embedder, self.embedding_cache)
+        self.embedder = embedder
+
+        self._lock = threading.RLock()
+        self._vectors_file = os.path.join(path, VECTORS_FILE)
+        self._conn = sqlite3.connect(os.path.join(path, DOCS_FILE), check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS docs (Pos INTEGER PRIMARY KEY, ID TEXT UNIQUE NOT NULL, RowID, Topic TEXT, Summary TEXT, Fields TEXT)')
+        self._conn.commit()
+
+        # rows past the sidecar's highest Pos are leftovers of an interrupted insert and get overwritten
+        self._size = self._conn.execute('SELECT COALESCE(MAX(Pos) + 1, 0) FROM docs').fetchone()[0]
+        self._vectors = None
+        if os.path.exists(self._vectors_file) and os.path.getsize(self._vectors_file) >= self.dim * 4:
+            self._vectors = np.memmap(self._vectors_file, dtype=np.float32, mode='r+',
+                                      shape=(os.path.getsize(self._vectors_file) // (self.dim * 4), self.dim))
+
+    def _reserve(self, rows: int) -> np.memmap:
+        # grow the vector file by doubling, the mapping is reopened on the larger file
+        capacity = 0 if self._vectors is None else len(self._vectors)
+        if rows <= capacity:
+            return self._vectors
+
+        capacity = max(INITIAL_CAPACITY, rows, 2 * capacity)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_file, 'r+b' if os.path.exists(self._vectors_file) else 'w+b') as f:
+            f.truncate(capacity * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_file, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        return self._vectors
+
+    def _embed(self, texts: List[str], kind: str) -> np.ndarray:
+        return normalize(self.embedder.embed(texts, kind))
+
+    def add_documents(self, documents: List[Dict]) -> None:
+        vectors = self._embed(['' if doc.get(TENSOR_FIELD) is None else str(doc[TENSOR_FIELD]) for doc in documents], 'passage')
+        self.add_vectors(documents, vectors)
+
+    def add_vectors(self, documents: List[Dict], vectors: np.ndarray) -> None:
+        '''
+        Add or replace documents with precomputed (len(documents), dim) embeddings, rows are normalized
+        '''
+        vectors = normalize(vectors)
+        with self._lock:
+            # Marqo semantics: a document with a known _id replaces the stored one, a missing _id gets a new one
+            ids = [str(doc['_id']) if doc.get('_id') is not None else uuid.uuid4().hex for doc in documents]
+            positions = {}
+            for i in range(0, len(ids), 512):
+                group = ids[i:i + 512]
+                positions.update(self._conn.execute(
+                    f'SELECT ID, Pos FROM docs WHERE ID IN ({",".join("?" * len(group))})', group))
+
+            size = self._size
+            rows = []
+            for _id, doc in zip(ids, documents):
+                if _id not in positions:
+                    positions[_id] = size
+                    size += 1
+                fields = {key: value for key, value in doc.items() if key not in ('_id', 'row_id', 'topic', TENSOR_FIELD)}
+                rows.append((positions[_id], _id, doc.get('row_id'), doc.get('topic'), doc.get(TENSOR_FIELD), json.dumps(fields)))
+
+            # vectors are durable before the sidecar points at them
+            matrix = self._reserve(size)
+            matrix[[positions[_id] for _id in ids]] = vectors
+            matrix.flush()
+            self._conn.executemany('INSERT OR REPLACE INTO docs (Pos, ID, RowID, Topic, Summary, Fields) VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._conn.commit()
+            self._size = size
+            self._added(positions.values(), matrix)
+
+    def _added(self, positions, matrix: np.ndarray) -> None:
+        '''
+        Hook for subclasses that index vectors beyond the matrix, called under the lock after every insert
+        '''
+
+    def _search_vectors(self, queries: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return exact_top_k(self._vectors[:self._size], queries, top_k)
+
+    def _filter_positions(self, filters: Dict) -> np.ndarray:
+        # sidecar columns, any other field is looked up in the JSON of the remaining fields
+        columns = {'_id': 'ID', 'row_id': 'RowID', 'topic': 'Topic', TENSOR_FIELD: 'Summary'}
+        clauses, params = [], []
+        for field, value in filters.items():
+            if field in columns:
+                clauses.append(f'CAST({columns[field]} AS TEXT) = ?')
+            else:
+                clauses.append('CAST(json_extract(Fields, ?) AS TEXT) = ?')
+                params.append(f'$."{field}"')
+            params.append(str(value))
+        return np.fromiter((pos for (pos,) in self._conn.execute(
+            f'SELECT Pos FROM docs WHERE {" AND ".join(clauses)} ORDER BY Pos', params)), dtype=np.int64)
+
+    def search_vectors(self, queries: np.ndarray, top_k: int, filters: Union[Dict, None] = None) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Search precomputed query embeddings, return per-query vector positions and scores by descending score
+
+        With filters, only the matching documents are scored, exactly
+        '''
+        queries = normalize(np.atleast_2d(queries))
+        with self._lock:
+            if self._size == 0:
+                return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+            if filters:
+                return exact_top_k(self._vectors, queries, top_k, rows=self._filter_positions(filters))
+            return self._search_vectors(queries, top_k)
+
+    def search(self, query: str, top_k: int, filters: Union[Dict, None] = None) -> List[Dict]:
+        positions, scores = self.search_vectors(self._embed([query], 'query'), top_k, filters)
+        with self._lock:
+            return self._hits(positions[0], scores[0]) if len(positions[0]) else []
+
+    def search_many(self, queries: List[str], top_k: int, filters: Union[Dict, None] = None) -> List[List[Dict]]:
+        # one embedding batch, and one matrix product per block of vectors for all queries
+        if not queries:
+            return []
+        positions, scores = self.search_vectors(self._embed(queries, 'query'), top_k, filters)
+        with self._lock:
+            rows = self._rows({int(pos) for query_positions in positions for pos in query_positions})
+            return [self._hits(query_positions, query_scores, rows) for query_positions, query_scores in zip(positions, scores)]
+
+    def _rows(self, positions) -> Dict[int, tuple]:
+        positions = list(positions)
+        rows = {}
+        for i in range(0, len(positions), 512):
+            group = positions[i:i + 512]
+            rows.update((row[0], row) for row in self._conn.execute(
+                f'SELECT Pos, ID, RowID, Topic, Summary, Fields FROM docs WHERE Pos IN ({",".join("?" * len(group))})', group))
+        return rows
+
+    def _hits(self, positions: np.ndarray, scores: np.ndarray, rows: Union[Dict[int, tuple], None] = None) -> List[Dict]:
+        positions = [int(pos) for pos in positions]
+        rows = self._rows(positions) if rows is None else rows
+        return [self._hit(rows[pos], float(score)) for pos, score in zip(positions, scores) if pos in rows]
+
+    @staticmethod
+    def _hit(row: tuple, score: float) -> Dict:
+        _, _id, row_id, topic, summary, fields = row
+        hit = json.loads(fields) if fields else {}
+        for key, value in (('row_id', row_id), ('topic', topic), (TENSOR_FIELD, summary)):
+            if value is not None:
+                hit[key] = value
+        hit['_id'] = _id
+        hit['_score'] = score
+        return hit
+
+    def documents(self, limit: int) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute('SELECT Pos, ID, RowID, Topic, Summary, Fields FROM docs ORDER BY Pos LIMIT ?', (limit,)).fetchall()
+        return [self._hit(row, 1.0) for row in rows]
+
+    def delete_all(self) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM docs')
+            self._conn.commit()
+            self._size = 0
+            self._vectors = None
+            if os.path.exists(self._vectors_file):
+                os.remove(self._vectors_file)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._size
+
+    def close(self) -> None:
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            self._conn.close()
+            if self.embedding_cache is not None:
+                self.embedding_cache.close()
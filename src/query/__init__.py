@@ -1,2 +1,2 @@
 from .improved_query import improved_query
-from .smart_query import smart_query
+from .smart_query import smart_query, asmart_query
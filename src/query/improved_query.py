@@ -16,17 +16,21 @@ Part 2: Extended Smart Query
 8. Return the final results to the user
 '''
 
-from typing import List, Dict
-from collections import defaultdict
+from typing import List, Dict, Union
 from src.core import LogosCluster, SumDB
+from src.core.sumdb_backends import SumDBBackend
+from src.query.smart_query import extract_hits, merge_hits
 import json
 
 
-def improved_query(cluster: LogosCluster, sumdb: SumDB, query_vector: str, top_k: int = 5, verbose: bool = False, para_db_host: str = 'localhost', para_db_port: int = 8883) -> List[Dict[str, str]]:
+def improved_query(cluster: LogosCluster, sumdb: SumDB, query_vector: str, top_k: int = 5, verbose: bool = False, para_db_host: str = 'localhost', para_db_port: int = 8883,
+                   para_db_backend: Union[SumDBBackend, None] = None) -> List[Dict[str, str]]:
     '''
     Perform an original smart query by querying SumDB first, then use the results to query LogosCluster
 
     Utilizing paraDB to search for more relevant and concise information
+    With a local para_db_backend (e.g. LocalBackend('paradb')), paragraphs seen by earlier queries
+    come from its embedding cache instead of being embedded again
     '''
     try:
         # Step 1: Query SumDB
@@ -38,46 +42,18 @@ def improved_query(cluster: LogosCluster, sumdb: SumDB, query_vector: str, top_k
             print(f'Extracted {len(sumdb_results)} results from SumDB')
 
         # Step 2: Extract the top-k results from SumDB
-        topic_map = defaultdict(list)
-        row_topic_map = defaultdict(str)
-        score_map = defaultdict(int)
-        summary_map = defaultdict(str)
-
-        for res in sumdb_results:
-            topic, row_id, summary, score = res['topic'], res['row_id'], res['summary'], res['_score']
-            topic_map[topic].append(row_id)
-            row_topic_map[row_id] = topic
-            score_map[row_id] = score
-            summary_map[row_id] = summary
+        # keyed by (topic, row_id), equal row IDs of different topics never collide
+        node_ids, score_map, summary_map = extract_hits(sumdb_results)
 
         # Step 3: Use the extracted results to query LogosCluster
         if verbose:
-            print('Querying LogosCluster by each topic node')
-        cluster_results = []
-        count = 0
-        for topic, row_ids in topic_map.items():
-            if verbose:
-                print(f'Node {count}: {topic}, row_ids: {row_ids}')
-            results = cluster.query_by_ids(row_ids, topic)
-
-            # match the score with result
-            for res in results:
-                _id, content, updated_at = res
-                cluster_results.append({
-                    'ID': _id,
-                    'RowID': row_topic_map[_id],
-                    'Summary': summary_map[_id],
-                    'Content': content,
-                    'Score': score_map[_id],
-                    'UpdatedAt': updated_at
-                })
-
-            count += 1
+            print(f'Querying LogosCluster by IDs: {dict(node_ids)}')
+        # each node is queried concurrently on the cluster's thread pool
+        rows = cluster.query_nodes_by_ids(node_ids)
 
         # Step 4: Get top-k documents and sort by score
         # sort result by score descending
-        cluster_results = sorted(
-            cluster_results, key=lambda x: x['Score'], reverse=True)
+        cluster_results = merge_hits(cluster, rows, score_map, summary_map)
 
         if verbose:
             print(
@@ -88,7 +64,7 @@ def improved_query(cluster: LogosCluster, sumdb: SumDB, query_vector: str, top_k
             print(f'START EXTENDED SMART QUERY')
         # Step 5: Split each document by paragraph
         # Set up paraDB on port 8883 (Split docs into paragraphs)
-        paraDB = SumDB(para_db_host, para_db_port)
+        paraDB = SumDB(para_db_host, para_db_port, backend=para_db_backend)
 
         # clear paraDB to prepare for new data
         if verbose:
@@ -102,9 +78,8 @@ def improved_query(cluster: LogosCluster, sumdb: SumDB, query_vector: str, top_k
         para_vectors = []
         para_id = 0
         for cluster_res in cluster_results:
-            row_id = cluster_res['RowID']
             content = cluster_res['Content']
-            topic = row_topic_map[row_id]
+            topic = cluster_res['Topic']
             content = content.split(' ')  # split by space
 
             for i in range(0, len(content), WORD_PER_PARAGRAPH):
@@ -6,16 +6,90 @@ The algorithm is as follows:
 2. Extract the top-k results from SumDB
 3. Use the extracted results to query LogosCluster
 4. Return the final results to the user
+
+In hybrid mode, a BM25 keyword search over the cluster's FTS5 indexes runs as well and both
+rankings are merged with reciprocal rank fusion. If SumDB returns nothing (e.g. overloaded),
+the keyword hits alone are returned.
+
+asmart_query is the asyncio variant for the serving path, it runs the (blocking) SumDB call in a thread
+while the keyword search and row hydration run on AsyncLogosCluster's node executors.
 '''
 
-from typing import List, Dict
+from typing import List, Dict, Tuple
 from collections import defaultdict
-from src.core import LogosCluster, SumDB
+import asyncio
+from src.core import AsyncLogosCluster, LogosCluster, SumDB
+from src.core.cluster import make_doc_id
+
+RRF_K = 60  # reciprocal rank fusion damping constant, 60 is the usual choice
+
+
+def fuse_results(vector_results: List[Dict[str, str]], lexical_results: List[Dict[str, str]], top_k: int = 5) -> List[Dict[str, str]]:
+    '''
+    Merge SumDB-ranked and BM25-ranked cluster rows with reciprocal rank fusion, Score becomes the fused score
+    '''
+    fused = {}
+    for results in (vector_results, lexical_results):
+        for rank, res in enumerate(results):
+            key = (res['Topic'], res['ID'])
+            if key not in fused:
+                # keyword-only hits have no summary, their content stands in for it
+                fused[key] = dict(res, Score=0.0)
+                fused[key].setdefault('Summary', res['Content'])
+            fused[key]['Score'] += 1 / (RRF_K + rank + 1)
+
+    return sorted(fused.values(), key=lambda x: x['Score'], reverse=True)[:top_k]
 
 
-def smart_query(cluster: LogosCluster, sumdb: SumDB, query_vector: str, top_k: int = 5) -> List[Dict[str, str]]:
+def extract_hits(sumdb_results: List[Dict[str, str]]) -> Tuple[Dict[str, List[int]], Dict[Tuple[str, int], float], Dict[Tuple[str, int], str]]:
+    '''
+    Turn SumDB hits into the row IDs to fetch per node and the score and summary of each (topic, row_id)
+
+    Hits are located by their own topic and row_id, the stored doc_id is only an alias of the pair
+    (vectors written before topic IDs were hashed from node names may carry a different one)
+    '''
+    node_ids = defaultdict(list)
+    score_map = defaultdict(int)
+    summary_map = defaultdict(str)
+    for res in sumdb_results:
+        key = (res['topic'], int(res['row_id']))
+        node_ids[key[0]].append(key[1])
+        score_map[key] = res['_score']
+        summary_map[key] = res['summary']
+
+    return node_ids, score_map, summary_map
+
+
+def merge_hits(cluster: LogosCluster, node_rows: Dict[str, List[tuple]], score_map: Dict[Tuple[str, int], float],
+               summary_map: Dict[Tuple[str, int], str]) -> List[Dict[str, str]]:
+    '''
+    Attach SumDB scores and summaries to the hydrated rows of every node, best first
+
+    DocID is None for nodes without a topic ID, the query path never registers one
+    '''
+    cluster_results = []
+    for topic, rows in node_rows.items():
+        topic_id = cluster.find_topic_id(topic)
+        for _id, content, updated_at in rows:
+            cluster_results.append({
+                'ID': _id,
+                'DocID': None if topic_id is None else make_doc_id(topic_id, _id),
+                'Topic': topic,
+                'Summary': summary_map[(topic, _id)],
+                'Content': content,
+                'Score': score_map[(topic, _id)],
+                'UpdatedAt': updated_at
+            })
+
+    # sort result by score descending
+    return sorted(cluster_results, key=lambda x: x['Score'], reverse=True)
+
+
+def smart_query(cluster: LogosCluster, sumdb: SumDB, query_vector: str, top_k: int = 5, hybrid: bool = False) -> List[Dict[str, str]]:
     '''
     Perform a smart query by querying SumDB first, then use the results to query LogosCluster
+
+    With hybrid, fuse the results with a keyword search over the cluster (needs FTS indexes, see LogosCluster.build_fts)
     '''
     try:
         # Step 1: Query SumDB
@@ -25,41 +99,19 @@ def smart_query(cluster: LogosCluster, sumdb: SumDB, query_vector: str, top_k: i
         # print(f'Extracted {len(sumdb_results)} results from SumDB')
 
         # Step 2: Extract the top-k results from SumDB
-        topic_map = defaultdict(list)
-        score_map = defaultdict(int)
-        summary_map = defaultdict(str)
-        for res in sumdb_results:
-            topic, row_id, summary, score = res['topic'], res['row_id'], res['summary'], res['_score']
-            topic_map[topic].append(row_id)
-            score_map[row_id] = score
-            summary_map[row_id] = summary
+        node_ids, score_map, summary_map = extract_hits(sumdb_results)
 
-        # print(f'Extracted info: {topic_map}')
+        # print(f'Extracted info: {node_ids}')
 
         # Step 3: Use the extracted results to query LogosCluster
-        # print('Querying LogosCluster by each topic node')
-        cluster_results = []
-        count = 0
-        for topic, row_ids in topic_map.items():
-            # print(f'Node {count}: {topic}, row_ids: {row_ids}')
-            results = cluster.query_by_ids(row_ids, topic)
-
-            # match the score with result
-            for res in results:
-                _id, content, updated_at = res
-                cluster_results.append({
-                    'ID': _id,
-                    'Summary': summary_map[_id],
-                    'Content': content,
-                    'Score': score_map[_id],
-                    'UpdatedAt': updated_at
-                })
-
-            count += 1
-
-        # sort result by score descending
-        cluster_results = sorted(
-            cluster_results, key=lambda x: x['Score'], reverse=True)
+        # print('Querying LogosCluster by topic and row ID')
+        # each node is queried concurrently on the cluster's thread pool
+        cluster_results = merge_hits(cluster, cluster.query_nodes_by_ids(node_ids), score_map, summary_map)
+
+        if hybrid:
+            lexical_results = cluster.search(query_vector, top_k)
+            return fuse_results(cluster_results, lexical_results, top_k)
+
         return cluster_results
 
     except Exception as e:
@@ -67,6 +119,34 @@ def smart_query(cluster: LogosCluster, sumdb: SumDB, query_vector: str, top_k: i
         return []
 
 
+async def asmart_query(cluster: AsyncLogosCluster, sumdb: SumDB, query_vector: str, top_k: int = 5, hybrid: bool = False) -> List[Dict[str, str]]:
+    '''
+    Async smart_query, the event loop keeps serving other requests while this one waits on SumDB or SQLite
+
+    With hybrid, the keyword search and its row hydration overlap the SumDB call
+    '''
+    try:
+        lexical_task = asyncio.ensure_future(cluster.search(query_vector, top_k)) if hybrid else None
+        try:
+            # the Marqo client blocks, keep it off the event loop
+            sumdb_results = await asyncio.to_thread(sumdb.query, query_vector, top_k)
+            node_ids, score_map, summary_map = extract_hits(sumdb_results)
+            cluster_results = merge_hits(cluster.cluster, await cluster.query_nodes_by_ids(node_ids), score_map, summary_map)
+        except BaseException:
+            if lexical_task is not None:
+                lexical_task.cancel()
+            raise
+
+        if hybrid:
+            return fuse_results(cluster_results, await lexical_task, top_k)
+
+        return cluster_results
+
+    except Exception as e:
+        print(f'Error at asmart_query: {e}')
+        return []
+
+
 if __name__ == '__main__':
     import time
     import json
@@ -77,7 +157,7 @@ if __name__ == '__main__':
     port = 8885  # for AuxiLogosb Extract
     # port = 8890  # for AuxiLogosb Qlora Abstract
     sumdb = SumDB(port=port)
-    cluster = LogosCluster('auxi_logos')
+    cluster = LogosCluster('auxi_logos', cache_rows=10000)  # repeated queries hit the same rows
     out_dir = 'debug'
 
     # # Perform smart query
@@ -99,4 +179,5 @@ if __name__ == '__main__':
         if (i + 1) % 1000 == 0:
             print(f'Finished query {i+1}/{n}')
     print(f'Smart query done in {time.perf_counter() - start} seconds.')
+    print(f'Row cache: {cluster.cache_stats()}')
     print('END Smart Query')